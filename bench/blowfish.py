@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Compares the Blowfish engines with the reference implementation, for
+setting up a key schedule and for decrypting constants of a few sizes.
+
+    python bench/blowfish.py
+"""
+
+import os, sys, timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from xmlconfig.plugins.crypto.blowfish import Blowfish
+from xmlconfig.plugins.crypto.fastblowfish import FastBlowfish, \
+    CryptographyBlowfish
+
+engines = [("reference", Blowfish), ("fast", FastBlowfish)]
+if CryptographyBlowfish.available():
+    engines.append(("cryptography", CryptographyBlowfish))
+
+def best(what, number, repeat=3):
+    "Best time of a few runs, per call, in microseconds"
+    return min(timeit.repeat(what, number=number, repeat=repeat)) \
+        / number * 1e6
+
+def main():
+    key = os.urandom(20)
+    print("{0:<14}{1:>14}".format("engine", "key setup us"))
+    for name, engine in engines:
+        print("{0:<14}{1:>14.1f}".format(name, best(lambda: engine(key), 5,
+            repeat=10)))
+
+    print("\n{0:<14}{1:>10}{2:>14}".format("engine", "bytes", "decrypt us"))
+    for size in (16, 1024, 65536):
+        data = Blowfish(key).encrypt(os.urandom(size))
+        for name, engine in engines:
+            cipher = engine(key)
+            number = max(1, 200000 // size)
+            print("{0:<14}{1:>10}{2:>14.1f}".format(name, size,
+                best(lambda: cipher.decrypt(data), number)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Benchmarks for loading and reading configs, over the synthetic documents
+written by generate.py at a few scales each.
+
+The suites follow the conventions of asv (airspeed velocity): setup() and
+teardown() around time_* methods, and track_* methods reporting a value,
+over the combinations of params. They can be run without asv too:
+
+    python bench/config.py [scenario ...]
+"""
+
+import os, sys, gc, shutil, tempfile, timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from xmlconfig import XmlConfig
+from generate import scenarios
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4
+    tracemalloc = None
+
+generators = dict((name, generator) for name, generator, scales in scenarios)
+params = [(name, scale) for name, generator, scales in scenarios
+    for scale in scales]
+
+class Scenario(object):
+    params = ["{0}-{1}".format(name, scale) for name, scale in params]
+    param_names = ["scenario"]
+
+    def setup(self, scenario):
+        name, scale = scenario.rsplit("-", 1)
+        self.path = tempfile.mkdtemp()
+        self.filename, self.key = generators[name](self.path, int(scale))
+
+    def teardown(self, scenario):
+        shutil.rmtree(self.path)
+
+    def loaded(self, engine=None):
+        config = XmlConfig("bench")
+        config.load(self.filename, engine=engine)
+        return config
+
+class Load(Scenario):
+    def time_load(self, scenario):
+        self.loaded()
+
+    def track_bytes_per_element(self, scenario):
+        "Memory held by the loaded config, per XML element"
+        if tracemalloc is None:
+            return float('nan')
+        gc.collect()
+        tracemalloc.start()
+        try:
+            config = self.loaded()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return size / float(count_elements(config))
+    track_bytes_per_element.unit = "bytes"
+
+class Engines(Scenario):
+    "Loading with each of the parse engines"
+    def time_load_sax(self, scenario):
+        self.loaded("sax")
+
+    def time_load_expat(self, scenario):
+        self.loaded("expat")
+
+class Get(Scenario):
+    def setup(self, scenario):
+        super(Get, self).setup(scenario)
+        self.config = self.loaded()
+        self.config.get(self.key)
+
+    def track_first_get(self, scenario):
+        "The content is processed on the first get, so time it on its own"
+        best = None
+        for x in range(3):
+            config = self.loaded()
+            start = timeit.default_timer()
+            config.get(self.key)
+            elapsed = (timeit.default_timer() - start) * 1e3
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    track_first_get.unit = "ms"
+
+    def time_warm_get(self, scenario):
+        self.config.get(self.key)
+
+class Reload(Scenario):
+    def setup(self, scenario):
+        super(Reload, self).setup(scenario)
+        self.config = self.loaded()
+        self.config.get(self.key)
+
+    def time_reload_unchanged(self, scenario):
+        self.config.reload()
+
+    def time_reload_forced(self, scenario):
+        self.config.reload(force=True)
+
+def count_elements(config):
+    count = 0
+    for document in config.documents.values():
+        for constants in document.constants.values():
+            for key, constant in constants.walk():
+                count += 1
+    return count
+
+suites = [Load, Engines, Get, Reload]
+
+def run(suite, method, scenario):
+    "Per call time in ms (best of a few runs) or the tracked value"
+    instance = suite()
+    instance.setup(scenario)
+    try:
+        if method.__name__.startswith("track_"):
+            return method(instance, scenario)
+        # Aim for about 0.2 seconds a run
+        once = timeit.timeit(lambda: method(instance, scenario), number=1)
+        number = max(1, min(10000, int(0.2 / max(once, 1e-6))))
+        return min(timeit.repeat(lambda: method(instance, scenario),
+            number=number, repeat=3)) / number * 1e3
+    finally:
+        instance.teardown(scenario)
+
+def main(names):
+    print("{0:<22}{1:<28}{2:>14}".format("scenario", "benchmark", "ms / value"))
+    for scenario in Scenario.params:
+        if names and scenario.rsplit("-", 1)[0] not in names:
+            continue
+        for suite in suites:
+            for attr in sorted(dir(suite)):
+                if not attr.startswith(("time_", "track_")):
+                    continue
+                method = getattr(suite, attr)
+                method = getattr(method, '__func__', method)
+                print("{0:<22}{1:<28}{2:>14.3f}".format(scenario,
+                    "{0}.{1}".format(suite.__name__, attr),
+                    run(suite, method, scenario)))
+                sys.stdout.flush()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
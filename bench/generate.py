@@ -0,0 +1,123 @@
+# encoding: utf-8
+
+"""
+Writes synthetic config documents for the benchmarks. Each generator
+takes the folder to write into and a scale, and returns the path of the
+main document and a key that is worth looking up in it.
+"""
+
+import os
+from base64 import standard_b64encode
+
+HEADER = u'<?xml version="1.0" encoding="utf-8"?>\n<config>\n'
+FOOTER = u'</config>\n'
+
+def write(path, name, body):
+    filename = os.path.join(path, name)
+    with open(filename, 'w') as f:
+        f.write(HEADER + body + FOOTER)
+    return filename
+
+def constants(elements, namespace=None):
+    if namespace:
+        open_tag = u'  <constants namespace="{0}">\n'.format(namespace)
+    else:
+        open_tag = u'  <constants>\n'
+    return open_tag + u''.join(elements) + u'  </constants>\n'
+
+def flat(path, count):
+    "count plain string, int and boolean constants"
+    types = [(u'string', u'value {0}'), (u'int', u'{0}'),
+        (u'boolean', u'true')]
+    elements = []
+    for i in range(count):
+        type, value = types[i % len(types)]
+        elements.append(u'    <{0} key="key{1}">{2}</{0}>\n'.format(
+            type, i, value.format(i)))
+    return write(path, "flat.xml", constants(elements)), \
+        "key{0}".format(count // 2)
+
+def deep(path, depth, width=10):
+    "Sections nested depth deep, with width constants at each level"
+    elements, key = [], []
+    for level in range(depth):
+        name = u"level{0}".format(level)
+        key.append(name)
+        elements.append(u'    <section key="{0}">\n'.format(name))
+        for i in range(width):
+            elements.append(u'      <string key="key{0}">{1}.{0}</string>\n'
+                .format(i, level))
+    elements.extend([u'    </section>\n'] * depth)
+    return write(path, "deep.xml", constants(elements)), \
+        ".".join(key + ["key0"])
+
+def references(path, count, depth=50):
+    """
+    count constants referring to the one before, in chains of depth (each
+    reference is resolved recursively) that start from a shared root
+    """
+    elements = [u'    <string key="root">start</string>\n']
+    for i in range(count):
+        previous = u"ref{0}".format(i - 1) if i % depth else u"root"
+        elements.append(u'    <string key="ref{0}">%({1}).{0}</string>\n'
+            .format(i, previous))
+    return write(path, "references.xml", constants(elements)), \
+        "ref{0}".format(count - 1)
+
+def imports(path, count, size=100):
+    "count imported documents of size constants, each in its own namespace"
+    elements = []
+    for i in range(count):
+        name = u"part{0}.xml".format(i)
+        write(path, name, constants(
+            u'    <string key="key{0}">part {1}</string>\n'.format(j, i)
+            for j in range(size)))
+        elements.append(u'  <constants namespace="part{0}" src="{1}"/>\n'
+            .format(i, name))
+    return write(path, "imports.xml", u''.join(elements)), \
+        "part{0}:key{1}".format(count - 1, size - 1)
+
+def payloads(path, count, size=4096):
+    "count base64 encoded and count encrypted constants of size bytes"
+    from xmlconfig import LOCAL_NAMESPACE
+    from xmlconfig.plugins.crypto import EncryptedContent, Blowfish
+    data = (b"0123456789abcdef" * (size // 16 + 1))[:size]
+    encoded = standard_b64encode(data).decode()
+    elements = []
+    for i in range(count):
+        elements.append(u'    <bytes key="encoded{0}" encoding="base64">'
+            u'{1}</bytes>\n'.format(i, encoded))
+        key = EncryptedContent().derive_key(u"secret{0}".format(i), u"c2FsdA==",
+            LOCAL_NAMESPACE)
+        elements.append(u'    <string key="secret{0}" '
+            u'options="salt:c2FsdA==;encoding:base64">{1}</string>\n'
+            .format(i, standard_b64encode(Blowfish(key).encrypt(data))
+                .decode()))
+    return write(path, "payloads.xml", constants(elements)), \
+        "secret{0}".format(count - 1)
+
+def choices(path, count):
+    "count constants chosen with <when> tests on vars and references"
+    elements = [u'    <string key="mode">production</string>\n']
+    for i in range(count):
+        elements.append(
+            u'    <string key="chosen{0}">\n'
+            u'      <choose>\n'
+            u'        <default>default {0}</default>\n'
+            u'        <when test="hostname == \'never-{0}\'">host</when>\n'
+            u'        <when test="\'%(mode)\' == \'production\'">'
+            u'production {0}</when>\n'
+            u'      </choose>\n'
+            u'    </string>\n'.format(i))
+    return write(path, "choices.xml", constants(elements)), \
+        "chosen{0}".format(count - 1)
+
+# Name, generator and the scales to generate it at
+scenarios = [
+    ("flat", flat, (1000, 10000, 50000)),
+    ("deep", deep, (10, 100, 400)),
+    ("references", references, (1000, 10000)),
+    ("imports", imports, (10, 100)),
+    ("payloads", payloads, (10, 100)),
+    ("choices", choices, (100, 1000)),
+]
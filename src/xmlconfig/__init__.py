@@ -5,9 +5,20 @@ xmlconfig for Python
 Copyright (c) 2011 klopen Enterprises. All rights reserved.
 """
 
-import os, re, sys, codecs
-from xml.sax import handler, make_parser
+import os, re, sys, copy, mmap, codecs, hashlib, threading
+from contextlib import contextmanager
+from time import time
+from xml.sax import handler, make_parser, SAXException
+from xml.parsers import expat
 from decimal import Decimal
+from io import BytesIO, StringIO
+from multiprocessing.pool import ThreadPool
+from .snapshot import SnapshotCache
+from .profile import Profile, qualified_name
+from .cache import LRUCache, ContentCache
+from .depends import DependencyGraph
+from .fetch import UrlFetcher
+from .stream import memory_file, StrippedStream, DecodingStream, TextStream
 
 LOCAL_NAMESPACE="__local"
     
@@ -25,29 +36,90 @@ if 'nose' in sys.modules:
 if sys.version_info >= (3,0):
     if 'urlopen' not in globals():
         from urllib.request import urlopen
+    from urllib.request import url2pathname
     from urllib.parse import urlparse, urljoin, urlunparse
 else:
     if 'urlopen' not in globals():
         from urllib2 import urlopen
+    from urllib import url2pathname
     from urlparse import urlparse, urljoin, urlunparse
+
+def normalize_headers(headers):
+    """
+    Copy of response headers with lower case names so they can be looked
+    up consistently across url schemes
+    """
+    return dict((name.lower(), value) for name, value in headers.items())
     
+def validators(headers):
+    "What tells one version of a document from another, of its headers"
+    return (headers.get('last-modified'), headers.get('etag'))
+
 class Options(dict):
+    """
+    Options of an element. Only the options set on the element are stored;
+    the rest are looked up in the defaults given, which are shared with
+    every other element of the same type rather than copied for each.
+    """
+    __slots__ = ('defaults',)
+
+    # Parsed "options" attributes. The same ones tend to be repeated
+    _parsed = LRUCache(1024)
+
     def __init__(self, defaults={}):
-        self.update(defaults)
-        self.process()
+        self.defaults = defaults
+
+    def __missing__(self, name):
+        return self.defaults[name]
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.defaults
+
+    def get(self, name, default=None):
+        if dict.__contains__(self, name):
+            return dict.__getitem__(self, name)
+        return self.defaults.get(name, default)
+
+    def _merged(self):
+        merged = dict(self.defaults)
+        merged.update(dict.items(self))
+        return merged
+
+    def keys(self):
+        return self._merged().keys()
+
+    def values(self):
+        return self._merged().values()
+
+    def items(self):
+        return self._merged().items()
+
+    def __iter__(self):
+        return iter(self._merged())
+
+    def __len__(self):
+        return len(self._merged())
+
+    def copy(self):
+        return self._merged()
 
     def process(self):
         # Support options combined into an "options" attribute in
         # a css style
-        if 'options' in self:
-            for x in self['options'].split(';'):
-                kv = x.strip().split(":",1)
-                if len(kv) == 2:
-                    self[kv[0]] = kv[1]
-                else:
-                    # If no colon, assume a "set" boolean option
-                    self[kv[0]] = True
-            del self['options']
+        if dict.__contains__(self, 'options'):
+            options = dict.pop(self, 'options')
+            parsed = self._parsed.get(options)
+            if parsed is None:
+                parsed = []
+                for x in options.split(';'):
+                    kv = x.strip().split(":",1)
+                    if len(kv) == 2:
+                        parsed.append((kv[0], kv[1]))
+                    else:
+                        # If no colon, assume a "set" boolean option
+                        parsed.append((kv[0], True))
+                parsed = self._parsed[options] = tuple(parsed)
+            self.update(parsed)
 
     @property
     def options_string(self):
@@ -67,7 +139,12 @@ class Options(dict):
                 self[name] = attrs[name]
         self.process()
                     
-class XmlConfigParser(handler.ContentHandler, object):
+class XmlConfigParser(object):
+    # There can be hundreds of thousands of constants, which are kept
+    # compact with __slots__. Classes with few instances, such as documents
+    # and <constants> elements, don't declare any and have a __dict__
+    __slots__ = ()
+
     content_types = {}
     default_options = {}
     required_options = []
@@ -75,22 +152,101 @@ class XmlConfigParser(handler.ContentHandler, object):
     
     namespace_separator = ":"
 
+    # Elements of classes that share options and have the same attributes
+    # use the same Options, which must then be left alone once built. Only
+    # worth it for elements without a key, as keys are all different
+    share_options = False
+    _shared_options = LRUCache(4096)
+
     def __init__(self, name=None, attrs=None, parser=None, parent=None, 
             namespace=None):
         self.parent = parent
         self._content = ""
-        self._options = Options(self.default_options)
         self.type = name
+        self._replaces = None
+        self._on_update = self._on_added = None
+        shared = None
+        if attrs is not None and self.share_options:
+            shared = (self.__class__, name, namespace, tuple(attrs.items()))
+            self._options = self._shared_options.get(shared)
+            if self._options is not None:
+                return
+        self._options = Options(self.default_options)
         if attrs is not None: self.parse_options(attrs)
         if namespace is not None and not self.has_option("namespace"):
             self.options["namespace"] = namespace
-        self.on_update = EventHook()
-        self.on_added = EventHook()
+        if shared is not None:
+            self._shared_options[shared] = self._options
         
+    # Constant this one takes the place of while a document is reloaded
+    _replaces = None
+
+    # Event hooks are created when first used
+    _on_update = _on_added = None
+
+    @property
+    def on_update(self):
+        if self._on_update is None:
+            self._on_update = EventHook()
+        return self._on_update
+
+    @on_update.setter
+    def on_update(self, hook):
+        self._on_update = hook
+
+    @property
+    def on_added(self):
+        if self._on_added is None:
+            self._on_added = EventHook()
+        return self._on_added
+
+    @on_added.setter
+    def on_added(self, hook):
+        self._on_added = hook
+
     @property
     def parser(self):
         return self.parent.parser
 
+    def replace(self, previous):
+        """
+        Take the place of previous, keeping its event subscribers
+        """
+        self._replaces = previous
+        self._on_update = previous._on_update
+        self._on_added = previous._on_added
+
+    # SAX events of no interest to the config handlers
+    def setDocumentLocator(self, locator):
+        pass
+
+    def startDocument(self):
+        pass
+
+    def endDocument(self):
+        pass
+
+    def startPrefixMapping(self, prefix, uri):
+        pass
+
+    def endPrefixMapping(self, prefix):
+        pass
+
+    def startElement(self, name, attrs):
+        pass
+
+    def characters(self, content):
+        pass
+
+    def ignorableWhitespace(self, whitespace):
+        pass
+
+    def processingInstruction(self, target, data):
+        pass
+
+    def skippedEntity(self, name):
+        pass
+
     def endElement(self, name):
         if self.parser is not None:
             self.parser.setContentHandler(self.parent)
@@ -144,12 +300,41 @@ class XmlConfig(XmlConfigParser):
 
     def __init__(self, name):
         self._files = {}
-        self.links = {}
-        self.documents = {}
+        # What readers see. Replaced as a whole (never modified) by
+        # whatever is loading documents. See _writing()
+        self._generation = Generation()
+        self._staged = None
+        self._depth = 0
+        # Loaded files as they were before the staged generation was
+        # started, put back if loading fails
+        self._files_before = None
+        self._lock = threading.RLock()
         self.parent = None
         self.name = name
+        self.snapshots = None
+        # Urls of the imports waiting for their namespace to be used, in
+        # declaration order, by namespace (see defer_import)
+        self._deferred = {}
+        # Content fetched by prefetch() waiting to be used
+        self._prefetched = {}
+        # Sourced content prefetched for a load and not read by the end of
+        # it, used once by the first open of its url (see open_url)
+        self._unread = ContentCache()
+        # Content sourced by constants with a ttl or no-cache, by url. Can
+        # be replaced with a cache shared with other configs
+        self.content_cache = ContentCache()
+        # Local files mapped into memory for mmap constants, by url
+        self._maps = {}
+        # Which constants refer to which. See refresh_dependents()
+        self.dependencies = DependencyGraph()
+        # Opens the urls of documents and sourced content. See
+        # xmlconfig.fetch
+        self.fetcher = UrlFetcher()
+        self._watcher = None
         # Events
         self.on_load = EventHook()
+        self.on_update = EventHook()
+        self.on_added = EventHook()
 
     def autoload(self, base_url="file:"):
         # Look for a file with [self.name]*.xml in current folder, then 
@@ -163,16 +348,132 @@ class XmlConfig(XmlConfigParser):
 
     # XXX: Move to XmlConfigDocument interface
 
-    def load(self, url, namespace=LOCAL_NAMESPACE, for_import=False):
+    def load(self, url, namespace=LOCAL_NAMESPACE, for_import=False,
+            workers=None, engine=None):
+        """
+        Load the document at url into namespace. If workers is given, the
+        document and everything it imports or sources is first fetched
+        concurrently using that many threads (see prefetch()). The engine
+        used to parse the document and its imports defaults to the
+        parse_engine of the config
+        """
+        if workers:
+            self.prefetch(url, workers, for_import)
+            try:
+                return self.load(url, namespace, for_import, engine=engine)
+            finally:
+                self.discard_prefetched()
+        # Get normalized, real location of url
+        self._load(self.get_real_location(url, for_import), namespace,
+            engine=engine)
+
+    def reload(self, url=None, force=False):
+        """
+        Load the document at url again if it has been modified since it
+        was loaded, or every loaded document if no url is given. Only the
+        documents that changed are parsed again, and the keys of constants
+        whose declarations changed are sent to on_update. Use force to
+        parse the document(s) regardless.
+        """
+        if url is None:
+            urls = list(self._files.keys())
+        else:
+            urls = [url]
+        for url in urls:
+            # With the engine the document was loaded with
+            self._load(url, self._files[url]['namespace'], force,
+                self._files[url].get('engine'))
+
+    def aload(self, url, namespace=LOCAL_NAMESPACE, for_import=False,
+            engine=None, executor=None):
+        """
+        Coroutine doing the same as load() without blocking the asyncio
+        event loop. See xmlconfig.aio
+        """
+        from xmlconfig.aio import aload
+        return aload(self, url, namespace, for_import, engine, executor)
+
+    def areload(self, url=None, force=False, executor=None):
+        "Coroutine doing the same as reload(). See xmlconfig.aio"
+        from xmlconfig.aio import areload
+        return areload(self, url, force, executor)
+
+    @property
+    def documents(self):
+        return self._generation.documents
+
+    @property
+    def links(self):
+        return self._generation.links
+
+    @contextmanager
+    def _writing(self):
+        """
+        Documents are never changed in place once readers can see them.
+        Loading builds up the next generation of documents, sharing what
+        did not change with the current one, and publishes it with a
+        single assignment when the outermost load is finished. Readers that
+        picked up the previous generation carry on with it undisturbed,
+        and it is released when the last of them is done with it. If
+        loading fails, nothing of it is published and the loaded files are
+        as they were before.
+        """
+        with self._lock:
+            if self._staged is None:
+                self._staged = self._generation.next()
+                self._files_before = dict(self._files)
+            self._depth += 1
+            failed = True
+            try:
+                yield self._staged
+                failed = False
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    staged, self._staged = self._staged, None
+                    files, self._files_before = self._files_before, None
+                    if failed:
+                        self._files.clear()
+                        self._files.update(files)
+                    else:
+                        staged.index = self.build_index(staged)
+                        self.refresh_dependents(self._generation, staged)
+                        self._generation = staged
+
+    def _load(self, url, namespace, force=False, engine=None):
+        with self._lock:
+            top = not self._depth
+            before = self._generation
+            # Imports are parsed with the same engine
+            outer, self._engine = self._engine, engine or self._engine
+            try:
+                if self.__load(url, namespace, force) and top:
+                    self.report_changes(before)
+            finally:
+                self._engine = outer
+
+    def __load(self, url, namespace, force=False):
         # Keep track of loaded files to ward off circular dependencies. If
         # a file is requested to be loaded that is already, and it has not
         # been modified since loading, don't load it.
         load = False
-        # Get normalized, real location of url
-        url = self.get_real_location(url, for_import)
         # Go ahead and open the url now so that we can check the time of
-        # last update (for reloading)
-        content = urlopen(url)
+        # last update (for reloading). If it's already loaded, only fetch
+        # it if it has changed since
+        previous = self._files.get(url)
+        reloading = previous is not None \
+            and previous['namespace'] == namespace
+        # Whether the fetcher only gives the content if it changed
+        conditional = False
+        if reloading and not force:
+            conditional = url not in self._prefetched \
+                and urlparse(url).scheme in self.conditional_schemes
+            content = self.open_url(url, previous['headers'])
+            if content is None:
+                # Not modified
+                return False
+        else:
+            content = self.open_url(url)
         if len(self._files) == 0:
             # This is the first document loaded. Remember it for future
             # reloading and importing, etc.
@@ -186,29 +487,379 @@ class XmlConfig(XmlConfigParser):
                 # document into different namespaces. Doing so without links
                 # would create unnecessary imports and potential circular
                 # dependency issues
-                self.links[namespace] = self._files[url]['namespace']
+                with self._writing() as staged:
+                    staged.links[namespace] = self._files[url]['namespace']
                 load = False
             #
-            # XXX Check if 'last-modified' in headers
             # Reload if the file has been modified
-            elif self._files[url]['headers']['last-modified'] \
-                    != content.headers['last-modified']:
+            elif force or conditional \
+                    or validators(self._files[url]['headers']) \
+                    != validators(normalize_headers(content.headers)):
                 load = True
         #
         # If file has never been loaded, it should be loaded (duh)
         else:
             load=True
             
+        try:
+            if load:
+                # Read it all and let go of the response before parsing.
+                # Imports are fetched while the document is parsed, and may
+                # need the connection (or pooled fetcher slot) it holds
+                source = memory_file(content.read())
+                source.headers = content.headers
+        finally:
+            content.close()
         if load:
             self.on_load.fire(url, namespace)
+            # Recorded ahead of parsing to ward off circular imports, and
+            # put back as it was if the document can't be parsed
             self._files[url] = {
                 'namespace':    namespace, 
-                'headers':      dict(content.headers.items())
+                'headers':      normalize_headers(source.headers),
+                'engine':       self._engine
             }
-            self.parse(content, namespace)
-        content.close()
+            try:
+                if self.snapshots is not None:
+                    self.snapshots.load(self, source, url, namespace)
+                else:
+                    self.parse(source, namespace)
+            except:
+                if previous is None:
+                    self._files.pop(url, None)
+                else:
+                    self._files[url] = previous
+                raise
+        return reloading and load
+
+    def report_changes(self, before):
+        """
+        Fire on_update for every constant that changed since the generation
+        given, and on_added for those not there before. Imports reloaded
+        along with a document are compared as part of it.
+        """
+        previous = before.index
+        for name, constant in self._generation.index.items():
+            if name not in previous:
+                self.on_added.fire(name)
+            elif constant is not previous[name] \
+                    and constant.signature != previous[name].signature:
+                self.on_update.fire(name)
+        # Constants worked out again because what they refer to changed
+        for name in self._generation.refreshed:
+            self.on_update.fire(name)
+
+    def refresh_dependents(self, before, staged):
+        """
+        Replace the constants of the staged generation that refer, directly
+        or not, to constants that changed or went away since the generation
+        before with fresh copies, so their content is worked out again with
+        the changed values. Their names are kept in the refreshed list of
+        the staged generation.
+        """
+        previous, index = before.index, staged.index
+        changed = set()
+        for name, constant in previous.items():
+            current = index.get(name)
+            if current is None or (current is not constant
+                    and current.signature != constant.signature):
+                changed.add(qualified_name(constant))
+        if not changed:
+            return
+        refreshed, copied = {}, {}
+        for name in self.dependencies.affected(changed) - changed:
+            constant = index.get(name)
+            # Constants declared anew are worked out afresh anyway
+            if constant is None or constant is not previous.get(name) \
+                    or id(constant) in refreshed:
+                continue
+            container = self.staged_container(constant, before, staged,
+                copied)
+            fresh = constant.fresh_copy(container)
+            container[constant.key] = fresh
+            refreshed[id(constant)] = fresh
+            if fresh._on_update is not None:
+                fresh._on_update.fire()
+            container.on_update.fire(fresh.key)
+        # Including under the names of linked namespaces
+        for name, constant in list(index.items()):
+            fresh = refreshed.get(id(constant))
+            if fresh is not None:
+                index[name] = fresh
+                staged.refreshed.append(name)
+            elif id(constant) in copied:
+                index[name] = copied[id(constant)]
+
+    def staged_container(self, constant, before, staged, copied):
+        """
+        Constants of the staged generation declaring the constant given.
+        The document and sections on the way to it that are still shared
+        with the generation before are copied first, and the copies of the
+        sections kept in copied by the id of the original, so the generation
+        before is left alone for its readers.
+        """
+        keys, node = [], constant.parent
+        while isinstance(node.parent, Constants):
+            keys.append(node.key)
+            node = node.parent
+        keys.reverse()
+        namespace = constant.namespace
+        for name, doc in list(staged.documents.items()):
+            container = doc.constants.get(namespace)
+            for key in keys:
+                if container is None:
+                    break
+                container = container.get(key)
+            if container is None or container.get(constant.key) \
+                    is not constant:
+                continue
+            if name not in staged._fresh:
+                doc = staged.document(name, self)
+            container = doc.constants[namespace]
+            for i, key in enumerate(keys):
+                section = container[key]
+                if before.index.get(namespace + self.namespace_separator
+                        + ".".join(keys[:i + 1])) is section:
+                    container[key] = section.copy(container)
+                    copied[id(section)] = container[key]
+                container = container[key]
+            return container
+        # Not declared by a document, which can't happen
+        raise KeyError("{0}: Cannot find constant".format(
+            qualified_name(constant)))
+
+    def dependency_lookup(self, dependent):
+        """
+        lookup() recording that the constant given refers to whatever is
+        looked up
+        """
+        name = qualified_name(dependent)
+        def lookup(key, namespace=LOCAL_NAMESPACE):
+            constant = self.lookup(key, namespace)
+            # Environment variables are not constants
+            if isinstance(constant, XmlConfigParser):
+                self.dependencies.add(name, qualified_name(constant))
+            return constant
+        return lookup
+
+    def watch(self, interval=1.0):
+        """
+        Start watching the loaded documents in a background thread and
+        reload the ones that change. Local files are watched with inotify
+        where available, otherwise everything is polled every interval
+        seconds.
+        """
+        if self._watcher is None:
+            from .watch import create_watcher
+            self._watcher = create_watcher(self, interval)
+            self._watcher.start()
+        return self._watcher
+
+    def unwatch(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def use_snapshots(self, path):
+        """
+        Keep compiled snapshots of loaded documents in the folder given.
+        Documents which have not changed since their snapshot was taken are
+        restored from it rather than being parsed again. Pass None to stop
+        using snapshots.
+        """
+        if path is None:
+            self.snapshots = None
+        else:
+            self.snapshots = SnapshotCache(path)
+
+    # Profile of the content processing, while profiling
+    profile = None
+
+    def start_profiling(self):
+        """
+        Record call counts, time, and bytes in and out of the content
+        processors, per processor and per namespace:key, until
+        stop_profiling() is called. Returns the Profile being recorded.
+        """
+        self.profile = Profile()
+        return self.profile
+
+    def stop_profiling(self):
+        profile, self.profile = self.profile, None
+        return profile
+
+    # Defer fetching and parsing imported documents until something is
+    # looked up in their namespace. Can also be set per import with the
+    # 'lazy' option of the <constants> element
+    lazy_imports = False
+
+    def defer_import(self, url, namespace):
+        """
+        Register url to be imported into namespace the first time the
+        namespace is used, after any other imports into the namespace
+        registered before
+        """
+        urls = self._deferred.setdefault(namespace, [])
+        if url not in urls:
+            urls.append(url)
+
+    def load_deferred(self):
+        """
+        Import everything still waiting on a lookup into its namespace
+        """
+        while self._deferred:
+            namespace, urls = self._deferred.popitem()
+            for url in urls:
+                self.load(url, namespace, for_import=True)
+
+    def open_url(self, url, headers=None):
+        """
+        Open the (real location of the) url, using content fetched ahead
+        of time by prefetch() if there is any. If the headers of an earlier
+        response for the url are given, http(s) requests are made
+        conditional on the content having changed since, and None is
+        returned if it has not.
+        """
+        prefetched = self._prefetched.pop(url, None)
+        if prefetched is not None:
+            data, headers, is_document = prefetched
+        elif headers is None and self._unread:
+            prefetched = self._unread.pop(url)
+            if prefetched is not None:
+                headers, data, fetched = prefetched
+        if prefetched is None:
+            return self.fetcher.open(url, headers)
+        if type(data) is bytes:
+            content = BytesIO(data)
+        else:
+            content = StringIO(data)
+        content.headers = headers
+        return content
+
+    def fetch_content(self, url, ttl=None):
+        """
+        Read the content at url. If a ttl (in seconds) is given, the
+        content is kept in the content cache, and used as it is for that
+        long after it was fetched. After that, it is revalidated and only
+        transferred again if it changed.
+        """
+        if ttl is None:
+            fp = self.open_url(url)
+        else:
+            cached = self.content_cache.get(url)
+            if cached is not None:
+                headers, data, checked = cached
+                if time() - checked < ttl:
+                    return data
+                fp = self.open_url(url, headers)
+                if fp is None:
+                    # Not modified
+                    self.content_cache[url] = (headers, data, time())
+                    return data
+            else:
+                fp = self.open_url(url)
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        if ttl is not None:
+            self.content_cache[url] = (normalize_headers(fp.headers), data,
+                time())
+        return data
+
+    def map_content(self, url):
+        """
+        Read-only memoryview of the local file at url, mapped into memory
+        rather than read. The map is shared by every constant sourcing the
+        file, and made again if the file is modified.
+        """
+        parts = urlparse(url)
+        if parts.scheme != 'file' or parts.netloc:
+            raise ValueError("{0}: Only local files can be mapped".format(url))
+        with open(url2pathname(parts.path), 'rb') as f:
+            stats = os.fstat(f.fileno())
+            version = (stats.st_mtime, stats.st_size)
+            mapped = self._maps.get(url)
+            if mapped is not None and mapped[0] == version:
+                return mapped[1]
+            if stats.st_size:
+                view = memoryview(mmap.mmap(f.fileno(), 0,
+                    access=mmap.ACCESS_READ))
+            else:
+                # Empty files can't be mapped
+                view = memoryview(b"")
+        self._maps[url] = (version, view)
+        return view
+
+    def prefetch(self, url, workers=8, for_import=False):
+        """
+        Fetch the document at url, along with the documents it imports and
+        the content sourced by its elements (src attributes), on a pool of
+        worker threads. Imported documents are scanned for more sources as
+        they arrive. The fetched content is held until used by load() or
+        when the content of a constant is sourced, so the documents are
+        still merged in declaration order, exactly as when loaded one at
+        a time. What is left when the load is done is dropped (see
+        discard_prefetched()).
+        """
+        url = self.get_real_location(url, for_import)
+        base = getattr(self, '_original_url', url)
+        self._prefetched = {}
+        pool = ThreadPool(workers)
+        try:
+            wave, seen = [(url, True)], set([url])
+            while wave:
+                fetched = pool.map(self._fetch, [x[0] for x in wave])
+                wave = self._prefetch_wave(wave, fetched, seen, base)
+        finally:
+            pool.close()
+
+    def _prefetch_wave(self, wave, fetched, seen, base):
+        """
+        Keep the content fetched for the (url, is_document) pairs of wave,
+        and return the pairs for what the documents among them import or
+        source that has not been seen yet
+        """
+        next_wave = []
+        for (location, is_document), result in zip(wave, fetched):
+            if result is None:
+                # Leave the error to surface when the url is used
+                continue
+            data, headers = result
+            self._prefetched[location] = (data, headers, is_document)
+            if not is_document:
+                continue
+            for src, is_import in SourceScanner.scan(data,
+                    self.lazy_imports):
+                src = self.get_real_location(src, True, base)
+                if src not in seen:
+                    seen.add(src)
+                    next_wave.append((src, is_import))
+        return next_wave
+
+    def discard_prefetched(self):
+        """
+        Let go of what a load prefetched and did not use. Documents
+        (unchanged since they were last loaded) are dropped. Sourced
+        content, which is only read when its constant first is, is kept
+        for that in a cache of its own, which holds no more than its size
+        """
+        prefetched, self._prefetched = self._prefetched, {}
+        for location, (data, headers, is_document) in prefetched.items():
+            if not is_document:
+                self._unread[location] = (headers, data, time())
+
+    def _fetch(self, url):
+        try:
+            content = self.fetcher.open(url)
+            try:
+                return content.read(), content.headers
+            finally:
+                content.close()
+        except Exception:
+            return None
 
-    def get_real_location(self, url, for_import=False):
+    def get_real_location(self, url, for_import=False, base=None):
         # XXX: Support url as a urllib.request.Request instance as well
         #      as a string.
         # If this is an import, then mangle the url if necessary to match
@@ -225,7 +876,10 @@ class XmlConfig(XmlConfigParser):
             # file to be loaded. Whether the new path is relative or 
             # absolute, urljoin will take care of it
             parts = urlparse(url)
-            new_url = urljoin(self._original_url, parts.path)
+            base = base or self._original_url
+            new_url = urljoin(base, parts.path)
+            absolute = parts.path.startswith('/') \
+                or urlparse(base).path.startswith('/')
         else:
             # Normalize the URL for consistent caching. Assume it's a file 
             # if no protocol was specified in the url. This will help ensure
@@ -235,32 +889,143 @@ class XmlConfig(XmlConfigParser):
             parts = urlparse(url)
             new_url = urlunparse((parts.scheme or 'file', parts.netloc, 
                 parts.path, parts.params, parts.query, parts.fragment))
+            absolute = parts.path.startswith('/')
         # Fix a python bug(?): if the path didn't start with a leading 
         # slash, the urlunparse (and urlunsplit too) are nice enough
         # to put one in (for file: scheme at least)
-        if not url.startswith('/'):
+        if not absolute:
             return new_url.replace("file:///","file:")
         else:
             return new_url
 
-    def parse(self, open_file, namespace):
-        if namespace in self.documents:
-            doc = self.documents[namespace]
-        else:
-            doc = self.documents[namespace] = XmlConfigDocument(
-                namespace=namespace, parent=self)
-        doc.parse(open_file)
+    # Schemes of the urls the fetcher revalidates (see xmlconfig.fetch),
+    # giving content only if it changed
+    conditional_schemes = ('http', 'https', 'file')
+
+    # Engine used to parse documents, one of XmlConfigDocument.parse_engines
+    parse_engine = "sax"
+    # Engine given to the load in progress
+    _engine = None
+
+    def parse(self, open_file, namespace, record=False, engine=None):
+        """
+        Parse the given document into namespace. If record is set, the
+        parse events are returned so they can later be given to replay()
+        """
+        engine = engine or self._engine or self.parse_engine
+        return self._build(namespace,
+            lambda doc: doc.parse(open_file, record, engine))
+
+    def replay(self, events, namespace):
+        self._build(namespace, lambda doc: doc.replay(events))
+
+    def _build(self, namespace, how):
+        # Imports will recurse back into here. The generation (and its
+        # index) is only published once the outermost document is finished
+        with self._writing() as staged:
+            return how(staged.document(namespace, self))
+
+    def build_index(self, generation=None):
+        """
+        Compile a flat table of every constant keyed by its fully qualified
+        name (namespace:dotted.key) so that lookups are a single dict probe.
+        The first document to declare a key wins, same as the document
+        search in lookup(). Linked namespaces are entered under their alias
+        as well. Built for each generation of loaded documents.
+        """
+        generation = generation or self._generation
+        sep = self.namespace_separator
+        declared = {}
+        for doc in generation.documents.values():
+            for namespace, constants in doc.constants.items():
+                for key, constant in constants.walk():
+                    declared.setdefault(namespace + sep + key, constant)
+        # Links take precedence over anything declared in the linked
+        # namespace itself
+        index = dict((name, constant) for name, constant in declared.items()
+            if name.split(sep, 1)[0] not in generation.links)
+        for alias, target in generation.links.items():
+            prefix = target + sep
+            for name, constant in declared.items():
+                if name.startswith(prefix):
+                    index[alias + sep + name[len(prefix):]] = constant
+        return index
 
     def __getitem__(self, name):
         return self.lookup(name)
 
     def get(self, name, default=None):
         try:
-            return self[name].value
+            constant = self[name]
+            # Environment variables are not constants
+            if isinstance(constant, XmlConfigParser):
+                return constant.value
+            return constant
         except KeyError:
             return default
 
+    def get_many(self, keys, defaults=None, namespace=LOCAL_NAMESPACE):
+        """
+        Values of the keys given, in a dict keyed the same way. Keys that
+        are not found take their value from defaults, or None. Sections
+        are given as dicts (see section_dict())
+        """
+        index = self._generation.index
+        sep = self.namespace_separator
+        defaults = defaults or {}
+        values = {}
+        for key in keys:
+            constant = index.get(key if sep in key else namespace + sep + key)
+            if constant is None:
+                try:
+                    constant = self.lookup(key, namespace)
+                except KeyError:
+                    values[key] = defaults.get(key)
+                    continue
+            if isinstance(constant, Constants):
+                values[key] = constant.as_dict()
+            elif isinstance(constant, XmlConfigParser):
+                values[key] = constant.value
+            else:
+                # Environment variables are not constants
+                values[key] = constant
+        return values
+
+    def freeze(self):
+        """
+        Work out the value of every constant, including those of lazy
+        imports, and return them in a read-only FrozenConfig keyed by
+        namespace and then by key, with sections nested. Values don't
+        change after, even for no-cache constants, and reading them is a
+        dict lookup
+        """
+        from .frozen import FrozenConfig
+        self.load_deferred()
+        return FrozenConfig(self)
+
+    def section_dict(self, key, namespace=LOCAL_NAMESPACE):
+        """
+        Values of everything in the section at key (ns:dotted.key), as a
+        dict keyed by the keys of its constants. Sections within are given
+        as dicts too
+        """
+        section = self.lookup(key, namespace)
+        if not isinstance(section, Constants):
+            raise ValueError("{0}: Not a section".format(key))
+        return section.as_dict()
+
     def lookup(self, key, namespace=LOCAL_NAMESPACE):
+        # Stick with one generation for the whole lookup
+        generation = self._generation
+        # Fast path: fully qualified name in the compiled index
+        try:
+            if self.namespace_separator in key:
+                return generation.index[key]
+            return generation.index[namespace + self.namespace_separator + key]
+        except KeyError:
+            pass
+
+        # Not indexed. Could be a magic namespace or a lazy import
         # XXX A regex would make more sense here
         split = key.split(self.namespace_separator, 1)
         if len(split) == 2:
@@ -274,10 +1039,17 @@ class XmlConfig(XmlConfigParser):
             return os.environ[key]
 
         # Namespace links
-        if namespace in self.links:
-            namespace = self.links[namespace]
+        if namespace in generation.links:
+            namespace = generation.links[namespace]
+
+        # Lazy imports are loaded on first use
+        if namespace in self._deferred:
+            with self._lock:
+                for url in self._deferred.pop(namespace, ()):
+                    self.load(url, namespace, for_import=True)
+            return self.lookup(key, namespace)
 
-        for ns, doc in self.documents.items():
+        for ns, doc in generation.documents.items():
             try:
                 return doc.lookup(key, namespace)
             except KeyError:
@@ -286,16 +1058,98 @@ class XmlConfig(XmlConfigParser):
         raise KeyError("{0}:{1}: Cannot lookup reference".format(namespace,key))
 
     def __iter__(self):
+        self.load_deferred()
         for namespace, doc in self.documents.items():
             for x in doc:
                 for key, y in x.items():
                     yield y
 
+class Generation(object):
+    """
+    The documents and namespace links loaded into an XmlConfig, along with
+    the index compiled from them, as seen by readers at one point in time.
+    A generation is not modified once it is published.
+    """
+    def __init__(self, documents=None, links=None):
+        self.documents = documents or {}
+        self.links = links or {}
+        self.index = {}
+        # Names of constants refreshed because what they refer to changed
+        self.refreshed = []
+        # Documents started afresh for this generation
+        self._fresh = set()
+
+    def next(self):
+        return Generation(dict(self.documents), dict(self.links))
+
+    def document(self, namespace, config):
+        """
+        Document to parse into namespace for this generation. The first
+        time, a new document is started with copies of the namespaces of
+        the previous generation's document, so parsing does not disturb
+        the previous one.
+        """
+        if namespace not in self._fresh:
+            doc = XmlConfigDocument(namespace=namespace, parent=config)
+            if namespace in self.documents:
+                for ns, constants in self.documents[namespace].constants.items():
+                    doc.constants[ns] = constants.copy(doc)
+            self.documents[namespace] = doc
+            self._fresh.add(namespace)
+        return self.documents[namespace]
+
+def sax_parser():
+    """
+    SAX parser keeping one copy of each element and attribute name rather
+    than one per element. (pyexpat does this by default)
+    """
+    parser = make_parser()
+    try:
+        parser.setFeature(handler.feature_string_interning, True)
+    except SAXException:
+        # Not supported by this parser
+        pass
+    return parser
+
+class ExpatParser(object):
+    """
+    Stands in for the SAX parser, driving the config handlers straight
+    from pyexpat. Rather than dispatching each event through Python, the
+    expat callbacks are bound to the methods of whichever handler owns the
+    content at the time, and text is delivered in one piece rather than
+    in chunks to be concatenated.
+    """
+    def __init__(self):
+        self._expat = expat.ParserCreate()
+        self._expat.buffer_text = True
+        self._expat.buffer_size = 65536
+
+    def setContentHandler(self, target):
+        # Setting the character data handler hands any text buffered so
+        # far to the previous handler first
+        self._expat.CharacterDataHandler = target.characters
+        self._expat.StartElementHandler = target.startElement
+        self._expat.EndElementHandler = target.endElement
+
+    def parse(self, source):
+        while True:
+            data = source.read(65536)
+            if not data:
+                break
+            self._expat.Parse(data, False)
+        self._expat.Parse(b"", True)
+
 class XmlConfigDocument(XmlConfigParser):
     """
     Simple encapsulation of a config document. This will represent each 
     document that is requested to be loaded or imported.
     """
+    # Parsers that can be given to parse(), by name
+    parse_engines = {
+        "sax":      sax_parser,
+        "expat":    ExpatParser
+    }
+
     def __init__(self, **kwargs):
         super(XmlConfigDocument, self).__init__(self, **kwargs)
         self.constants = {}
@@ -319,11 +1173,27 @@ class XmlConfigDocument(XmlConfigParser):
     def parser(self):
         return self._parser
 
-    def parse(self, open_file):
-        self._parser = make_parser()
+    def parse(self, open_file, record=False, engine="sax"):
+        if engine not in self.parse_engines:
+            raise ValueError("{0}: Unknown parse engine".format(engine))
+        self._parser = self.parse_engines[engine]()
+        if record:
+            # Handlers swap themselves in through the recorder rather than
+            # the SAX parser so that every event passes through it
+            parser, self._parser = self._parser, EventRecorder(self)
+            parser.setContentHandler(self._parser)
+            parser.parse(open_file)
+            return self._parser.events
         self._parser.setContentHandler(self)
         self._parser.parse(open_file)
 
+    def replay(self, events):
+        """
+        Rebuild the document from events previously recorded by parse()
+        """
+        self._parser = EventRecorder(self)
+        self._parser.replay(events)
+
     @property
     def namespace(self):
         return self.default_namespace
@@ -338,12 +1208,97 @@ class XmlConfigDocument(XmlConfigParser):
     def __iter__(self):
         return iter(self.constants.values())
 
+class SourceScanner(handler.ContentHandler, object):
+    """
+    Quick pass over a document listing the src attributes of its elements
+    without building any constants. Used to find what to fetch ahead of
+    loading a document.
+    """
+    def __init__(self, lazy_imports=False):
+        handler.ContentHandler.__init__(self)
+        self.lazy_imports = lazy_imports
+        self.sources = []
+
+    def startElement(self, name, attrs):
+        options = Options()
+        options.merge(dict(attrs.items()))
+        if options.get("src") is None:
+            return
+        if options.get("mmap"):
+            # Mapped when used, never read
+            return
+        if name == "constants":
+            # Leave lazy imports for when they are used
+            lazy = options.get("lazy")
+            if lazy or (lazy is None and self.lazy_imports):
+                return
+        self.sources.append((options["src"], name == "constants"))
+
+    @classmethod
+    def scan(cls, data, lazy_imports=False):
+        scanner = cls(lazy_imports)
+        parser = make_parser()
+        parser.setContentHandler(scanner)
+        try:
+            if type(data) is bytes:
+                parser.parse(BytesIO(data))
+            else:
+                parser.parse(StringIO(data))
+        except Exception:
+            # Malformed documents will be reported when loaded
+            pass
+        return scanner.sources
+
+class EventRecorder(handler.ContentHandler, object):
+    """
+    Stands in for the SAX parser as far as the config handlers are
+    concerned. Events are forwarded to whichever handler currently owns the
+    content and are kept in a compact list of tuples that can be serialized
+    and fed back through replay() later without parsing the XML again.
+    """
+    START, CHARACTERS, END = range(3)
+
+    def __init__(self, target):
+        handler.ContentHandler.__init__(self)
+        self._target = target
+        self.events = []
+
+    def setContentHandler(self, target):
+        self._target = target
+
+    def startElement(self, name, attrs):
+        self.events.append((self.START, name, dict(attrs.items())))
+        self._target.startElement(name, attrs)
+
+    def characters(self, what):
+        # The SAX parser is free to split text up. Keep it in one piece
+        if self.events and self.events[-1][0] == self.CHARACTERS:
+            self.events[-1] = (self.CHARACTERS, self.events[-1][1] + what)
+        else:
+            self.events.append((self.CHARACTERS, what))
+        self._target.characters(what)
+
+    def endElement(self, name):
+        self.events.append((self.END, name))
+        self._target.endElement(name)
+
+    def replay(self, events):
+        self.events = events
+        for event in events:
+            if event[0] == self.START:
+                self._target.startElement(event[1], event[2])
+            elif event[0] == self.CHARACTERS:
+                self._target.characters(event[1])
+            else:
+                self._target.endElement(event[1])
+
 @XmlConfig.register_child("constants")
 class Constants(XmlConfigParser, dict):
 
     content_types = {}
     default_options = {
-        "src":          None
+        "src":          None,
+        "lazy":         None        # Import src when namespace is first used
     }
     namespace_separator = "."
     
@@ -354,23 +1309,47 @@ class Constants(XmlConfigParser, dict):
             raise ValueError("Cannot re-declare magic namespace 'env'")
         if self.options["src"] is not None:
             # Load in constants
-            getConfig(self.root.name).load(self.options["src"], 
-                self.namespace, for_import=True)
+            config = self.root
+            lazy = self.options["lazy"]
+            if lazy is None:
+                lazy = config.lazy_imports
+            # Imports into the document's own namespace are merged with it
+            # and have to be loaded in place
+            if lazy and self.namespace != self.parent.namespace:
+                config.defer_import(self.options["src"], self.namespace)
+            else:
+                config.load(self.options["src"], self.namespace,
+                    for_import=True)
         
     def startElement(self, name, attrs):
         # Manages the handler for this element's content
         # if there is a child, then the element belongs to it
         new_constant = self.content_types[name](name=name, 
             attrs=attrs, parent=self, namespace=self.namespace)
-        if new_constant.key in self:
-            new_constant = self[new_constant.key]
-            new_constant.clear()
-            new_constant.options.merge(new_constant.default_options)
-            new_constant.options.merge(attrs)
-        else:
-            self[new_constant.key] = new_constant
+        previous = self.get(new_constant.key)
+        if previous is None and self._replaces is not None:
+            previous = self._replaces.get(new_constant.key)
+        if previous is not None:
+            # Reloading. The previous constant is left alone for anyone
+            # still reading the previous generation
+            new_constant.replace(previous)
+        self[new_constant.key] = new_constant
         self.parser.setContentHandler(new_constant)
+
+    def copy(self, parent):
+        """
+        Shallow copy, sharing the constants, for parsing a document again
+        without touching this one
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.update(self)
+        clone.parent = parent
+        return clone
         
+    # Sections are compared by their contents on reload
+    signature = None
+
     def lookup(self, key):
         splitkey = key.split(self.namespace_separator, 1)
         if splitkey[0] in self:
@@ -378,8 +1357,77 @@ class Constants(XmlConfigParser, dict):
                 return self[splitkey[0]].lookup(splitkey[1])
             return self[splitkey[0]]
         raise KeyError("{0}: Cannot find constant".format(key))
+
+    def as_dict(self):
+        """
+        Values of the constants declared here, keyed by their keys, with
+        sections as dicts of their own
+        """
+        return dict((key, constant.as_dict()
+                if isinstance(constant, Constants) else constant.value)
+            for key, constant in self.items())
+
+    def walk(self, prefix=""):
+        """
+        Yields (dotted.key, constant) for every constant declared here,
+        descending into sections
+        """
+        for key, constant in self.items():
+            yield prefix + key, constant
+            if isinstance(constant, Constants):
+                for x in constant.walk(prefix + key + self.namespace_separator):
+                    yield x
             
 
+class ReferenceTemplate(object):
+    """
+    Content with %(key) references, compiled into the literal pieces between
+    the references and the keys referenced. Rendering is then a lookup per
+    reference and a single join. Templates are immutable and shared for
+    identical content via compile().
+    """
+    reference_regex = re.compile(r'%\(([^%)]+)\)')
+
+    # Compiled templates by source string
+    _cache = {}
+    cache_size = 10000
+
+    def __init__(self, source):
+        self.source = source
+        self.pieces = []
+        self.references = []
+        start = 0
+        for m in self.reference_regex.finditer(source):
+            self.pieces.append(source[start:m.start()])
+            self.references.append(m.group(1))
+            start = m.end()
+        self.pieces.append(source[start:])
+
+    @classmethod
+    def compile(cls, source):
+        try:
+            return cls._cache[source]
+        except KeyError:
+            if len(cls._cache) >= cls.cache_size:
+                cls._cache.clear()
+            template = cls._cache[source] = cls(source)
+            return template
+
+    def render(self, lookup, namespace):
+        if not self.references:
+            return self.source
+        pieces = self.pieces
+        parts = [pieces[0]]
+        for i, key in enumerate(self.references):
+            parts.append(str(lookup(key, namespace)))
+            parts.append(pieces[i+1])
+        what = "".join(parts)
+        # Referenced values can make up new references, for instance
+        # %(key%(suffix)). Keep going until there are no more
+        if "%(" in what:
+            return self.compile(what).render(lookup, namespace)
+        return what
+
 @Constants.register_child("string")
 class SimpleConstant(XmlConfigParser):
     
@@ -392,47 +1440,85 @@ class SimpleConstant(XmlConfigParser):
         "ordered":              False,      # Maintain order of a section
         "src":                  None,       # Where content is located
         "resolve-references":   True,       # Resolve %(key) references
-        "no-cache":             False       # Don't cache content (used with src)
+        "no-cache":             False,      # Don't cache content (used with src)
+        "ttl":                  None        # Seconds to reuse src content for
     }
 
     required_options = ["key"]
     forbidden_options = ["namespace"]
+
+    # _value and _settled (the content worked out from the declared
+    # _content) are only set once worked out. Subclasses declare __slots__
+    # of their own to stay compact
+    __slots__ = ('parent', 'type', '_options', '_content', '_replaces',
+        '_on_update', '_on_added', 'children', '_source', '_value',
+        '_settled')
     
     def __init__(self, **kwargs):
         super(SimpleConstant, self).__init__(**kwargs)
-        self.children =[]
+        # Most constants have no child elements
+        self.children = ()
 
     def startElement(self, name, attrs):
         if not name in self.content_types:
             raise ValueError("{0}: Invalid content".format(name))
+        if not self.children:
+            self.children = []
         self.children.append(self.content_types[name](name=name, 
             attrs=attrs, parent=self))
         self.parser.setContentHandler(self.children[-1])
         
     def endElement(self, name):
         super(SimpleConstant, self).endElement(name)
-        if hasattr(self, '_prev_content') \
-                and self._content != self._prev_content:
-            self.on_update.fire()
-            self.parent.on_update.fire(self.key)
+        # Only a digest of the declared content is kept to tell if it
+        # changed on reload, unless the content is no bigger
+        if len(self._content) > 20:
+            self._source = hashlib.sha1(self._content.encode('utf-8')).digest()
+        else:
+            self._source = self._content
+        previous, self._replaces = self._replaces, None
+        if previous is not None:
+            if type(previous) is type(self) \
+                    and previous.signature == self.signature:
+                # Unchanged. Keep the previous constant, along with
+                # whatever it already worked out. It now belongs to this
+                # generation, which must not keep the previous one alive
+                previous.parent = self.parent
+                self.parent[self.key] = previous
+            else:
+                if self._on_update is not None:
+                    self._on_update.fire()
+                self.parent.on_update.fire(self.key)
         
     def characters(self, what):
         self._content += what
-        
-    def clear(self):
-        "Prep for reloading"
-        self._prev_content = self._content
-        self._content = ""
+
+    @property
+    def signature(self):
+        """
+        What the constant was declared with, used to tell if it changed
+        when its document is loaded again
+        """
+        return (self._source, sorted(self.options.items()),
+            [x.signature for x in self.children])
 
     @property
     def value(self):
         # XXX For some more security, it might be nice to provide an
         #     option to not store the value in memory
-        if self.options["no-cache"] or not hasattr(self, '_value'):
+        if self.volatile or not hasattr(self, '_value'):
             self._value = self.parseValue()
 
         return self._value
         
+    @property
+    def volatile(self):
+        """
+        Content sourced with no-cache or a ttl is worked out again each
+        time it is read, so changes to the source are picked up
+        """
+        return self.options["no-cache"] or self.options["ttl"] is not None
+
     @property
     def key(self):
         return self.options['key']
@@ -443,32 +1529,72 @@ class SimpleConstant(XmlConfigParser):
         
     @property
     def content(self):
-        if not hasattr(self,"_content_settled") or not self._content_settled:
+        # Readers don't lock. The declared content is never replaced, so
+        # threads working it out at the same time all start from it, and
+        # the result is kept with a single assignment
+        try:
+            return self._settled
+        except AttributeError:
             if len(self.children) > 0:
                 # XXX: How to handle multiple children ?
                 return self.children[0].content
             
-            for proc in self.content_processors:
-                T=proc.process(self, self._content)
-                if T is not None:
-                    self._content=T
+            content = self._content
+            profile = getattr(self.root, 'profile', None)
+            if profile is not None:
+                content = profile.process(self, self.content_processors,
+                    content)
+            else:
+                for proc in self.content_processors:
+                    T=proc.process(self, content)
+                    if T is not None:
+                        content=T
 
-            # Cache result (maybe)
-            if not self.options["no-cache"]:
-                self._content_settled=True
-        return self._content
+            # Cache result (maybe). Otherwise it is processed again from
+            # the declared content next time
+            if not self.volatile:
+                self._settled = content
+            return content
 
-    reference_regex = re.compile(r'%\(([^%)]+)\)')
+    def open(self):
+        """
+        File-like object giving the content, worked out a chunk at a time
+        as it is read. Large content sourced from a file or url can then be
+        copied elsewhere without holding all of it in memory. Content that
+        has references to resolve, or is already worked out, is read from
+        memory
+        """
+        if self.children or hasattr(self, '_settled'):
+            return memory_file(self.content)
+        fp = memory_file(self._content)
+        for proc in self.content_processors:
+            fp = proc.stream(self, fp)
+        return fp
+
+    reference_regex = ReferenceTemplate.reference_regex
     def resolve_references(self, what):
-        while True:
-            m=self.reference_regex.search(what)
-            if m is None: break
-            # XXX This is pretty ugly
-            what = what[0:m.start()] \
-                + str(self.root.lookup(m.group(1), 
-                    self.parent.namespace)) \
-                + what[m.end():]
-        return what
+        template = ReferenceTemplate.compile(what)
+        if not template.references:
+            return what
+        return template.render(self.root.dependency_lookup(self),
+            self.parent.namespace)
+
+    def fresh_copy(self, parent=None):
+        """
+        Copy of the constant as declared, without the content and value
+        worked out from the constants it refers to, for when they change
+        """
+        clone = copy.copy(self)
+        if parent is not None:
+            clone.parent = parent
+        for name in ('_settled', '_value'):
+            try:
+                delattr(clone, name)
+            except AttributeError:
+                pass
+        if self.children:
+            clone.children = [x.fresh_copy(clone) for x in self.children]
+        return clone
 
     @classmethod
     def register_processor(cls, after=None):
@@ -492,43 +1618,91 @@ class ContentProcessor(object):
     order=10
     def process(self, constant, content):
         raise NotImplementedError()
+
+    def stream(self, constant, fp):
+        """
+        File-like object giving the processed content of fp, for
+        SimpleConstant.open(). Unless overridden, the content is all read
+        and processed at once
+        """
+        try:
+            content = fp.read()
+        finally:
+            fp.close()
+        T = self.process(constant, content)
+        return memory_file(content if T is None else T)
     
 @SimpleConstant.register_processor()
 class ContentLoader(ContentProcessor):
     def process(self, constant, content):
         if constant.options["src"] is not None:
             try:
-                # Translate relative paths and such. We'll need to look up
-                # the actual XmlConfig handling this constant. Its root
-                # element will know the name originally passed into 
-                # getConfig(name)
-                url = getConfig(constant.root.name).get_real_location(
-                    constant.options["src"], for_import=True)
-                fp = urlopen(url)
+                # Translate relative paths and such, with the XmlConfig
+                # handling this constant
+                config = constant.root
+                url = config.get_real_location(constant.options["src"],
+                    for_import=True)
+                ttl = constant.options["ttl"]
+                if ttl is not None:
+                    ttl = float(ttl)
+                elif constant.options["no-cache"]:
+                    # Revalidated on every read, and only transferred again
+                    # if it changed
+                    ttl = 0
+                return config.fetch_content(url, ttl)
             except ValueError:
                 # Invalid url
                 raise
-            else:
-                return fp.read()
+
+    def stream(self, constant, fp):
+        if constant.options["src"] is None:
+            return fp
+        if constant.volatile:
+            # Through the content cache
+            return super(ContentLoader, self).stream(constant, fp)
+        config = constant.root
+        return config.open_url(config.get_real_location(
+            constant.options["src"], for_import=True))
             
 @SimpleConstant.register_processor(after=ContentLoader)
 class WhitespaceStripper(ContentProcessor):
     def process(self, constant, content):
         if not constant.options["preserve-whitespace"]:
             return content.strip()
+
+    def stream(self, constant, fp):
+        if constant.options["preserve-whitespace"]:
+            return fp
+        return StrippedStream(fp)
             
 @SimpleConstant.register_processor(after=WhitespaceStripper)
 class ContentDecoder(ContentProcessor):
     def process(self, constant, content):
         if constant.options["encoding"] is not None:
-            try:
-                decoder = codecs.getdecoder(constant.options["encoding"])
-            except LookupError:
-                # Python bug(?): Try it with _codec
-                decoder = codecs.getdecoder(constant.options["encoding"] + "_codec")
-            # Don't convert to a string because it may be binary content.
-            # It will be converted later if necessary
-            return decoder(content.encode())[0]
+            decoder = self.decoder(constant.options["encoding"])
+            # Content sourced from a url is already bytes. Don't convert
+            # to a string because it may be binary content. It will be
+            # converted later if necessary
+            if type(content) is not bytes:
+                content = content.encode()
+            return decoder(content)[0]
+
+    def stream(self, constant, fp):
+        encoding = constant.options["encoding"]
+        if encoding is None:
+            return fp
+        block_size = DecodingStream.block_size_of(encoding)
+        if block_size is None:
+            return super(ContentDecoder, self).stream(constant, fp)
+        return DecodingStream(fp, self.decoder(encoding), block_size)
+
+    @staticmethod
+    def decoder(encoding):
+        try:
+            return codecs.getdecoder(encoding)
+        except LookupError:
+            # Python bug(?): Try it with _codec
+            return codecs.getdecoder(encoding + "_codec")
 
 @SimpleConstant.register_processor(after=ContentDecoder)
 class Python3kStringCrap(ContentProcessor):
@@ -539,6 +1713,11 @@ class Python3kStringCrap(ContentProcessor):
         if not constant.has_option('binary-content'):
             if type(content) is bytes:
                 return content.decode()
+
+    def stream(self, constant, fp):
+        if constant.has_option('binary-content'):
+            return fp
+        return TextStream(fp)
             
 @SimpleConstant.register_processor(after=Python3kStringCrap)
 class ReferenceResolver(ContentProcessor):
@@ -548,14 +1727,42 @@ class ReferenceResolver(ContentProcessor):
         if constant.options["resolve-references"]:
             return constant.resolve_references(content)
 
+    def stream(self, constant, fp):
+        # References can only be resolved with all the content at hand
+        if not constant.options["resolve-references"]:
+            return fp
+        return super(ReferenceResolver, self).stream(constant, fp)
+
 @Constants.register_child("bytes")
 class BinaryConstant(SimpleConstant):
+    __slots__ = ()
     default_options = SimpleConstant.default_options.copy()
     default_options.update({
         "resolve-references":   False,
-        "binary-content":       True
+        "binary-content":       True,
+        "mmap":                 False       # Map a local src file into memory
     })
 
+    @property
+    def content(self):
+        if not self.options["mmap"]:
+            return super(BinaryConstant, self).content
+        # The file is used as it is, without going through the content
+        # processors, which would copy it
+        if self.options["src"] is None:
+            raise ValueError("{0}: mmap needs a src file".format(self.key))
+        if self.options["encoding"] is not None or self.has_option("salt"):
+            raise ValueError("{0}: Mapped content can't be decoded or "
+                "decrypted".format(self.key))
+        config = self.root
+        return config.map_content(config.get_real_location(
+            self.options["src"], for_import=True))
+
+    def open(self):
+        if self.options["mmap"]:
+            return memory_file(self.content)
+        return super(BinaryConstant, self).open()
+
     def parseValue(self):
         # noop
         return self.content
@@ -566,12 +1773,14 @@ class BinaryConstant(SimpleConstant):
 
 @Constants.register_child("int")
 class IntegerConstant(SimpleConstant):
+    __slots__ = ()
     def parseValue(self):
         return int(self.content)
         
 @Constants.register_child("boolean")    
 @Constants.register_child("bool")    
 class BooleanConstant(SimpleConstant):
+    __slots__ = ()
     def parseValue(self):
         try:
             # Handle numeric content
@@ -590,6 +1799,11 @@ class SectionConstant(Constants):
     def key(self):
         return self.options["key"]
 
+    def endElement(self, name):
+        super(SectionConstant, self).endElement(name)
+        # Let go of the previous generation
+        self._replaces = None
+
     @property
     def value(self):
         return self
@@ -597,11 +1811,13 @@ class SectionConstant(Constants):
 @Constants.register_child("decimal")
 @Constants.register_child("float")
 class DecimalConstant(SimpleConstant):
+    __slots__ = ()
     def parseValue(self):
         return Decimal(self.content)
     
 @Constants.register_child("list")
 class ListConstant(SimpleConstant):
+    __slots__ = ()
     default_options = SimpleConstant.default_options.copy()
     default_options.update({
         "delimiter":            ",",        # List item delimiter
@@ -625,8 +1841,45 @@ class ListConstant(SimpleConstant):
             T[i] = self.type_funcs[self.options['type']](x)
         return T 
 
+class ChooseVars(dict):
+    """
+    Variables the <when> tests are evaluated with. Changes are counted so
+    that choices made with earlier values are not reused.
+    """
+    version = 0
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name, value)
+        self.version += 1
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+    def setdefault(self, name, value=None):
+        self.version += 1
+        return dict.setdefault(self, name, value)
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
 @SimpleConstant.register_child("choose")
 class ChooseHandler(SimpleConstant):
+    __slots__ = ('_default', 'selected', '_memo')
+    share_options = True
     required_options=[]
     default_options={}
     forbidden_options=["key"]
@@ -635,49 +1888,94 @@ class ChooseHandler(SimpleConstant):
     # XXX Either move vars all the way up to the XmlConfig class
     #     or provide some interface to get the add_var method into
     #     the XmlConfig class
-    vars = {
+    vars = ChooseVars({
         "hostname": socket.gethostname()
-    }
+    })
     builtins = {
         "__builtins__": {}
     }
+
+    # Compiled tests, by their source with references resolved
+    _compiled = LRUCache(1024)
     
     # XXX Enforce required child 'default'
 
     # XXX Define option for raising errors encountered in eval'ing <when>
     #     elements. (KeyError for lookups would apply too)
+
+    def __init__(self, **kwargs):
+        super(ChooseHandler, self).__init__(**kwargs)
+        # (vars, version, tests) the last choice was made with, and the
+        # choice
+        self._memo = None
     
     @property
     def content(self):
-        # Run when blocks
+        # The choice only depends on the vars and the tests, once their
+        # references are resolved. If neither changed, neither did it
+        tests = []
         for x in self.children:
             if isinstance(x, ChooseDefault):
                 self._default = x
             elif isinstance(x, ChooseWhen):
-                # Eval the test element (safely)
                 try:
-                    # Note that Python will add a __builtins__ element with
-                    # the real builtins if one is not given
-                    if eval(x.resolve_references(x.options["test"]), 
-                            self.builtins, self.vars):
-                        self.selected = x
-                        break
-                except NameError:
-                    raise
-                except:
-                    pass
+                    tests.append(x.resolve_references(x.options["test"]))
+                except Exception:
+                    # Never true, same as a test that fails to evaluate
+                    tests.append(None)
+        version = getattr(self.vars, "version", None)
+        memo = (id(self.vars), version, tuple(tests))
+        if version is None or self._memo is None or self._memo[0] != memo:
+            self.selected = self.choose(tests)
+            self._memo = (memo, self.selected)
         else:
-            # None of the when elements matched. Use the default
-            self.selected = self._default
+            self.selected = self._memo[1]
         return self.selected.content
+
+    def choose(self, tests):
+        whens = [x for x in self.children if isinstance(x, ChooseWhen)]
+        for x, test in zip(whens, tests):
+            code = self.compile_test(test)
+            if code is None:
+                continue
+            # Eval the test element (safely)
+            try:
+                # Note that Python will add a __builtins__ element with
+                # the real builtins if one is not given
+                if eval(code, self.builtins, self.vars):
+                    return x
+            except NameError:
+                raise
+            except:
+                pass
+        # None of the when elements matched. Use the default
+        return self._default
+
+    @classmethod
+    def compile_test(cls, test):
+        "Code for the test given, or None if it isn't valid"
+        if test is None:
+            return None
+        code = cls._compiled.get(test)
+        if code is None:
+            try:
+                code = compile(test, "<when>", "eval")
+            except SyntaxError:
+                code = False
+            cls._compiled[test] = code
+        return code or None
         
 @ChooseHandler.register_child("default")
 class ChooseDefault(SimpleConstant):
+    __slots__ = ()
+    share_options = True
     required_options=[]
     forbidden_options=["key"]
     
 @ChooseHandler.register_child("when")
 class ChooseWhen(SimpleConstant):
+    __slots__ = ()
+    share_options = True
     required_options=["test"]
     forbidden_options=["key"]
     
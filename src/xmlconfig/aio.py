@@ -0,0 +1,92 @@
+# encoding: utf-8
+
+"""
+Loading for programs running on asyncio (Python 3.7+). The documents, what
+they import and the content their elements source are fetched concurrently
+in an executor, so the event loop is not held up by the network or the
+disk. The documents are then merged into the config on the loop's thread,
+in declaration order, exactly as by load() and reload():
+
+    await config.aload("http://example.com/config.xml")
+    await config.areload()
+
+Lazy imports, and content fetched again because of the no-cache option,
+are still fetched when first used.
+"""
+
+import asyncio
+from xmlconfig import LOCAL_NAMESPACE
+
+def revalidate(config, url, headers=None):
+    """
+    Content and headers at url, or None if it has not changed since the
+    response with the headers given
+    """
+    content = config.open_url(url, headers)
+    if content is None:
+        return None
+    try:
+        return content.read(), content.headers
+    finally:
+        content.close()
+
+async def prefetch(config, wave, seen, base, executor=None, fetched=None):
+    """
+    Fetch the (url, is_document) pairs of wave, and then what the documents
+    among them import or source, wave after wave, into the prefetched
+    content of the config. If given, fetched is the content of the first
+    wave, already fetched
+    """
+    loop = asyncio.get_running_loop()
+    while wave:
+        if fetched is None:
+            fetched = await asyncio.gather(*[
+                loop.run_in_executor(executor, config._fetch, url)
+                for url, is_document in wave])
+        wave = config._prefetch_wave(wave, fetched, seen, base)
+        fetched = None
+
+async def aload(config, url, namespace=LOCAL_NAMESPACE, for_import=False,
+        engine=None, executor=None):
+    "XmlConfig.load() that does not block the event loop"
+    location = config.get_real_location(url, for_import)
+    base = getattr(config, '_original_url', location)
+    await prefetch(config, [(location, True)], set([location]), base,
+        executor)
+    try:
+        config.load(url, namespace, for_import, engine=engine)
+    finally:
+        config.discard_prefetched()
+
+async def areload(config, url=None, force=False, executor=None):
+    "XmlConfig.reload() that does not block the event loop"
+    loop = asyncio.get_running_loop()
+    if url is None:
+        urls = list(config._files.keys())
+    else:
+        urls = [url]
+    # Revalidate every document at once. Only those that changed are
+    # transferred
+    checked = await asyncio.gather(*[
+        loop.run_in_executor(executor, revalidate, config, x,
+            None if force else config._files[x]['headers'])
+        for x in urls])
+    changed = [(x, result) for x, result in zip(urls, checked)
+        if result is not None]
+    if not changed:
+        return
+    # Unchanged documents imported by changed ones are imported again when
+    # they are parsed, so they are fetched too
+    base = getattr(config, '_original_url', None)
+    await prefetch(config, [(x, True) for x, result in changed],
+        set(x for x, result in changed), base, executor,
+        [result for x, result in changed])
+    try:
+        for x, result in changed:
+            # Skip documents already reloaded as the import of another.
+            # The rest are known to have changed
+            if x in config._prefetched:
+                config._load(x, config._files[x]['namespace'], True,
+                    config._files[x].get('engine'))
+    finally:
+        config.discard_prefetched()
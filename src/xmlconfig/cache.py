@@ -0,0 +1,100 @@
+# encoding: utf-8
+
+"""
+Small caches shared by the config machinery
+"""
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Mapping holding at most maxsize items, dropping the least recently used
+    item to make room for a new one. Safe to share between threads.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Most recently used items are kept at the end
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._items[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+class ContentCache(LRUCache):
+    """
+    LRUCache of fetched content by url, holding no more than maxbytes of
+    content in all. Items are (headers, data, checked) tuples, where checked
+    is when the content was fetched or last revalidated. Content bigger
+    than maxbytes is not kept at all.
+    """
+    def __init__(self, maxbytes=16 << 20, maxsize=4096):
+        super(ContentCache, self).__init__(maxsize)
+        self.maxbytes = maxbytes
+        self.bytes = 0
+
+    def __setitem__(self, key, item):
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous[1])
+            if len(item[1]) > self.maxbytes:
+                return
+            self._items[key] = item
+            self.bytes += len(item[1])
+            while len(self._items) > self.maxsize \
+                    or self.bytes > self.maxbytes:
+                key, item = self._items.popitem(last=False)
+                self.bytes -= len(item[1])
+
+    def __delitem__(self, key):
+        with self._lock:
+            self.bytes -= len(self._items.pop(key)[1])
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.bytes -= len(item[1])
+            return item
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
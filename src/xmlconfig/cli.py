@@ -41,6 +41,7 @@ class CliCommand(object):
 
 from xmlconfig.plugins import *
 import xmlconfig.validate
+import xmlconfig.codegen
 from optparse import OptionParser
 import sys
 def cli_main():
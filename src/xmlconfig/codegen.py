@@ -0,0 +1,226 @@
+# encoding: utf-8
+
+"""
+Generates a module of classes with a slot for each constant of a loaded
+configuration, so that settings can be read as attributes:
+
+    cfg = Config.load(getConfig())
+    cfg.db.port
+
+Sections become classes of their own. The values are read from the config
+in one go when an instance is made, after which reading one is as fast as
+reading any slotted attribute. Use Config.bind() for an instance that is
+made again whenever the config is reloaded.
+"""
+
+import keyword, re, sys
+from xmlconfig import getConfig, Constants, SimpleConstant, BinaryConstant, \
+    BooleanConstant, IntegerConstant, DecimalConstant, ListConstant, \
+    LOCAL_NAMESPACE
+from xmlconfig.cli import CliCommand
+from optparse import make_option
+
+# Python type of the values of each kind of constant. Checked in order, so
+# subclasses come before SimpleConstant
+value_types = [
+    (BinaryConstant,    "bytes"),
+    (BooleanConstant,   "bool"),
+    (IntegerConstant,   "int"),
+    (DecimalConstant,   "Decimal"),
+    (ListConstant,      "list"),
+    (SimpleConstant,    "str"),
+]
+
+def value_type(constant):
+    for clas, name in value_types:
+        if isinstance(constant, clas):
+            return name
+    return "object"
+
+# Names the generated classes use themselves, and the class of the
+# namespace also gets from Accessors. Keys that would take one of them are
+# given a trailing underscore, as keywords are
+reserved_names = frozenset(["__slots__", "__types__", "__init__"])
+root_reserved_names = reserved_names | frozenset(["__keys__",
+    "__namespace__", "load", "bind"])
+
+# Names the generated module uses at module level, which section classes
+# are kept from taking
+module_names = frozenset(["Accessors", "Decimal", "bytes", "bool", "int",
+    "list", "str", "object"])
+
+def attribute_name(key, reserved=reserved_names):
+    "Python identifier for a constant key"
+    name = re.sub(r'\W', '_', key)
+    if name[:1].isdigit():
+        name = "_" + name
+    if keyword.iskeyword(name) or name in reserved:
+        name += "_"
+    return name
+
+def class_name(path):
+    return "".join(attribute_name(x).title().replace("_", "")
+        for x in path) or "Section"
+
+class Section(object):
+    "Layout of one class to generate"
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.fields = []
+        self.reserved = root_reserved_names if not path else reserved_names
+
+    def add(self, key, kind):
+        attribute = attribute_name(key, self.reserved)
+        for x in self.fields:
+            if x[0] == attribute:
+                raise ValueError("{0}: Key clashes with '{1}' in {2}".format(
+                    key, x[1], ".".join(self.path) or "namespace"))
+        self.fields.append((attribute, key, kind))
+
+def sections(config, namespace=LOCAL_NAMESPACE, name="Config"):
+    """
+    Layout of the classes for the constants of the namespace given, from
+    the documents loaded into config. The class for the namespace itself
+    comes last
+    """
+    config.load_deferred()
+    index = config._generation.index
+    prefix = namespace + config.namespace_separator
+    names = set(module_names)
+    names.add(name)
+    layout = {(): Section(name, ())}
+    for qualified in sorted(x for x in index if x.startswith(prefix)):
+        constant = index[qualified]
+        path = tuple(qualified[len(prefix):].split(
+            Constants.namespace_separator))
+        if isinstance(constant, Constants):
+            section_name = class_name(path)
+            while section_name in names:
+                section_name += "_"
+            names.add(section_name)
+            layout[path] = Section(section_name, path)
+            kind = section_name
+        else:
+            kind = value_type(constant)
+        layout[path[:-1]].add(path[-1], kind)
+    # Inner sections are generated first so their classes are defined by
+    # the time they are used
+    return [layout[x] for x in sorted(layout, key=len, reverse=True)]
+
+def generate(config, namespace=LOCAL_NAMESPACE, name="Config"):
+    "Source of a module for the namespace given of the config"
+    classes = sections(config, namespace, name)
+    known = set(x.name for x in classes)
+    lines = [
+        "# encoding: utf-8",
+        "",
+        '"""',
+        "Typed access to the {0} namespace of a configuration".format(
+            namespace),
+        "",
+        "Generated by xmlconfig codegen. Edits will be lost",
+        '"""',
+        "",
+        "from decimal import Decimal",
+        "from xmlconfig.codegen import Accessors",
+        "",
+        "try:",
+        "    bytes",
+        "except NameError:",
+        "    bytes = str",
+        "",
+    ]
+    root = classes[-1]
+    for section in classes:
+        attributes = tuple(x[0] for x in section.fields)
+        lines.extend([
+            "class {0}({1}):".format(section.name,
+                "Accessors" if section is root else "object"),
+            "    __slots__ = {0!r}".format(attributes),
+            "    __types__ = {" + ", ".join("{0!r}: {1}".format(attribute,
+                kind) for attribute, key, kind in section.fields) + "}",
+            "",
+            "    def __init__(self, values):",
+        ])
+        if not section.fields:
+            lines.append("        pass")
+        for attribute, key, kind in section.fields:
+            if kind in known:
+                lines.append("        self.{0} = {1}(values[{2!r}])".format(
+                    attribute, kind, key))
+            else:
+                lines.append("        self.{0} = values[{1!r}]".format(
+                    attribute, key))
+        lines.append("")
+    lines.extend([
+        "    __namespace__ = {0!r}".format(namespace),
+        "    __keys__ = {0!r}".format(tuple(x[1] for x in root.fields)),
+        "",
+    ])
+    return "\n".join(lines)
+
+class Accessors(object):
+    """
+    Base of the generated class of a namespace, which sets __namespace__
+    and the __keys__ of its constants
+    """
+    __slots__ = ()
+    __namespace__ = LOCAL_NAMESPACE
+    __keys__ = ()
+
+    @classmethod
+    def load(cls, config):
+        "Instance filled with the values of the config given"
+        return cls(config.get_many(cls.__keys__, namespace=cls.__namespace__))
+
+    @classmethod
+    def bind(cls, config):
+        "Binding giving an instance kept up to date with the config"
+        return Binding(cls, config)
+
+class Binding(object):
+    """
+    Instance of a generated class kept up to date with a config. It is
+    made again, the next time it is asked for, after the config loads or
+    reloads anything
+    """
+    def __init__(self, clas, config):
+        self.clas = clas
+        self.config = config
+        self._generation = None
+        self._instance = None
+
+    @property
+    def current(self):
+        generation = self.config._generation
+        if generation is not self._generation:
+            self._instance = self.clas.load(self.config)
+            self._generation = generation
+        return self._instance
+
+@CliCommand.register
+class GenerateAccessors(CliCommand):
+    __command__ = "codegen"
+    __help__ = "Generate classes for typed access to a config document"
+    __args__ = [
+        make_option("-n","--namespace", dest="namespace",
+            default=LOCAL_NAMESPACE, metavar="namespace",
+            help="Namespace to generate classes for. Defaults to the " \
+                 "namespace of the document itself"),
+        make_option("-c","--class", dest="name", default="Config",
+            metavar="name", help="Name of the class for the namespace"),
+        make_option("-o","--output", dest="output", metavar="file",
+            help="Write the module to file rather than standard out"),
+    ]
+    __usage__ = "%prog {0} [options] file"
+
+    def run(self, options, *args):
+        config = getConfig()
+        config.load(args[0])
+        source = generate(config, options.namespace, options.name)
+        if options.output:
+            with open(options.output, 'w') as f:
+                f.write(source)
+        else:
+            sys.stdout.write(source)
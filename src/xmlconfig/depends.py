@@ -0,0 +1,44 @@
+# encoding: utf-8
+
+"""
+Which constants refer to which, recorded as references are resolved, so
+that what was worked out from a constant can be worked out again when it
+changes on reload.
+"""
+
+import threading
+
+class DependencyGraph(object):
+    """
+    Constants referring to each constant, by fully qualified name
+    (namespace:dotted.key), with constants in linked namespaces under the
+    namespace they are declared in. References are only ever added, so a
+    constant that stops referring to another may be worked out again when
+    it didn't need to be, which is harmless.
+    """
+    def __init__(self):
+        self.dependents = {}
+        self._lock = threading.Lock()
+
+    def add(self, dependent, referenced):
+        with self._lock:
+            dependents = self.dependents.get(referenced)
+            if dependents is None:
+                dependents = self.dependents[referenced] = set()
+            dependents.add(dependent)
+
+    def affected(self, names):
+        "Names of the constants referring to names, directly or not"
+        affected = set()
+        with self._lock:
+            pending = list(names)
+            while pending:
+                for name in self.dependents.get(pending.pop(), ()):
+                    if name not in affected:
+                        affected.add(name)
+                        pending.append(name)
+        return affected
+
+    def clear(self):
+        with self._lock:
+            self.dependents.clear()
@@ -0,0 +1,289 @@
+# encoding: utf-8
+
+"""
+Fetchers open the urls of the documents a config loads and of the content
+its elements source. Each XmlConfig has one, a UrlFetcher unless another
+is given:
+
+    myConfig.fetcher = PooledFetcher(connections=4)
+
+A fetcher's open(url, headers=None) returns a file-like object with the
+response headers in its headers attribute. If the headers of an earlier
+response for the url are given, http(s) requests are made conditional on
+the content having changed since (and local files are checked for having
+been modified), and None is returned if it has not.
+Every fetcher keeps the number of requests, connections, bytes and the
+time taken by host in its stats.
+"""
+
+import os, socket, sys, threading
+from email.utils import formatdate
+from io import BytesIO
+from timeit import default_timer
+import xmlconfig
+
+if sys.version_info >= (3,0):
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.request import Request, url2pathname
+    from urllib.error import HTTPError
+    from urllib.parse import urlparse, urljoin
+else:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib2 import Request, HTTPError
+    from urllib import url2pathname
+    from urlparse import urlparse, urljoin
+
+class FetchStats(object):
+    __slots__ = ('requests', 'connections', 'bytes', 'time')
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.bytes = 0
+        self.time = 0.0
+
+    def __repr__(self):
+        return "<FetchStats requests={0} connections={1} bytes={2} " \
+            "time={3:.6f}>".format(self.requests, self.connections,
+                self.bytes, self.time)
+
+def conditional_headers(headers):
+    "Request headers asking for the content only if changed since headers"
+    request_headers = {}
+    if headers:
+        if 'etag' in headers:
+            request_headers['If-None-Match'] = headers['etag']
+        if 'last-modified' in headers:
+            request_headers['If-Modified-Since'] = headers['last-modified']
+    return request_headers
+
+class Response(object):
+    """
+    Response being read. Counts the bytes read and, when closed, records
+    them and the time since the request was made with the fetcher, and
+    calls release (if given) rather than closing the response itself. It
+    is closed as soon as the whole body is read
+    """
+    def __init__(self, fp, headers, fetcher, host, start, release=None):
+        self.fp = fp
+        self.headers = headers
+        self.fetcher = fetcher
+        self.host = host
+        self.start = start
+        self.release = release
+        self.bytes = 0
+
+    def read(self, size=-1):
+        if self.fp is None:
+            return b""
+        whole = size is None or size < 0
+        try:
+            data = self.fp.read() if whole else self.fp.read(size)
+        except:
+            self.close()
+            raise
+        self.bytes += len(data)
+        if whole or not data:
+            # Give the connection back without waiting on the caller
+            self.close()
+        return data
+
+    def close(self):
+        if self.fp is None:
+            return
+        fp, self.fp = self.fp, None
+        try:
+            if self.release is not None:
+                self.release()
+            else:
+                fp.close()
+        finally:
+            self.fetcher.record(self.host, size=self.bytes,
+                elapsed=default_timer() - self.start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Fetcher(object):
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def open(self, url, headers=None):
+        raise NotImplementedError()
+
+    def record(self, host, requests=0, connections=0, size=0, elapsed=0.0):
+        with self._lock:
+            stats = self.stats.get(host)
+            if stats is None:
+                stats = self.stats[host] = FetchStats()
+            stats.requests += requests
+            stats.connections += connections
+            stats.bytes += size
+            stats.time += elapsed
+
+    def total(self):
+        "Stats of all the hosts together"
+        total = FetchStats()
+        with self._lock:
+            for stats in self.stats.values():
+                for name in FetchStats.__slots__:
+                    setattr(total, name,
+                        getattr(total, name) + getattr(stats, name))
+        return total
+
+    def close(self):
+        pass
+
+class UrlFetcher(Fetcher):
+    "Opens each url on its own with urlopen"
+    def open(self, url, headers=None):
+        parts = urlparse(url)
+        host = parts.netloc or parts.scheme
+        start = default_timer()
+        self.record(host, requests=1, connections=1)
+        if headers and parts.scheme == 'file' \
+                and not self.modified(parts, headers):
+            self.record(host, elapsed=default_timer() - start)
+            return None
+        elif headers and parts.scheme in ('http', 'https'):
+            request = Request(url)
+            for name, value in conditional_headers(headers).items():
+                request.add_header(name, value)
+            try:
+                fp = xmlconfig.urlopen(request)
+            except HTTPError as ex:
+                if ex.code == 304:
+                    self.record(host, elapsed=default_timer() - start)
+                    return None
+                raise
+        else:
+            # Looked up on the module so tests can stand in for it
+            fp = xmlconfig.urlopen(url)
+        return Response(fp, fp.headers, self, host, start)
+
+    @staticmethod
+    def modified(parts, headers):
+        """
+        If the local file has changed since the headers given. The
+        last-modified header of file urls is the time the file was last
+        modified
+        """
+        if 'last-modified' not in headers or parts.netloc:
+            return True
+        try:
+            stats = os.stat(url2pathname(parts.path))
+        except (OSError, ValueError):
+            # Leave the error to urlopen
+            return True
+        return formatdate(stats.st_mtime, usegmt=True) \
+            != headers['last-modified']
+
+class PooledFetcher(Fetcher):
+    """
+    Keeps the connections to each http(s) host open between requests, and
+    makes no more than the given number of requests to a host at once.
+    Other urls are opened by the fallback fetcher (a UrlFetcher by
+    default)
+    """
+    connection_types = {'http': HTTPConnection, 'https': HTTPSConnection}
+    # Redirects followed for a request before giving up
+    max_redirects = 5
+
+    def __init__(self, connections=4, timeout=30, fallback=None):
+        super(PooledFetcher, self).__init__()
+        self.connections = connections
+        self.timeout = timeout
+        self.fallback = fallback or UrlFetcher()
+        # Idle connections and request slots by (scheme, netloc)
+        self._idle = {}
+        self._slots = {}
+
+    def open(self, url, headers=None, redirects=None):
+        parts = urlparse(url)
+        if parts.scheme not in self.connection_types:
+            return self.fallback.open(url, headers)
+        if redirects is None:
+            redirects = self.max_redirects
+        host = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        slot = self._slot(host)
+        slot.acquire()
+        start = default_timer()
+        try:
+            connection, response = self._request(host, path,
+                conditional_headers(headers))
+        except:
+            slot.release()
+            raise
+        release = lambda: self._release(host, connection, response, slot)
+        status = response.status
+        if status < 300:
+            return Response(response, response.msg, self, parts.netloc,
+                start, release)
+        # Read what is left so the connection can be used again
+        body = response.read()
+        release()
+        self.record(parts.netloc, size=len(body),
+            elapsed=default_timer() - start)
+        location = response.getheader('location')
+        if status == 304:
+            return None
+        elif status < 400 and location and redirects:
+            return self.open(urljoin(url, location), headers, redirects - 1)
+        raise HTTPError(url, status, response.reason, response.msg,
+            BytesIO(body))
+
+    def _slot(self, host):
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = threading.BoundedSemaphore(
+                    self.connections)
+            return slot
+
+    def _request(self, host, path, headers):
+        while True:
+            with self._lock:
+                idle = self._idle.get(host)
+                connection = idle.pop() if idle else None
+            reused = connection is not None
+            if not reused:
+                connection = self.connection_types[host[0]](host[1],
+                    timeout=self.timeout)
+            self.record(host[1], requests=1, connections=int(not reused))
+            try:
+                connection.request("GET", path, headers=headers)
+                return connection, connection.getresponse()
+            except (socket.error, HTTPException):
+                connection.close()
+                # The server may have closed an idle connection. Try again
+                # on a new one, but only once
+                if not reused:
+                    raise
+
+    def _release(self, host, connection, response, slot):
+        # The connection can be used again once the whole response is read
+        # (which closes it), unless the server is closing it
+        try:
+            if response.isclosed() and not response.will_close:
+                with self._lock:
+                    self._idle.setdefault(host, []).append(connection)
+            else:
+                response.close()
+                connection.close()
+        finally:
+            slot.release()
+
+    def close(self):
+        "Close the idle connections"
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
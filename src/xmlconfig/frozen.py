@@ -0,0 +1,77 @@
+# encoding: utf-8
+
+"""
+Read-only snapshot of the values of a config, made by XmlConfig.freeze()
+"""
+
+from xmlconfig import Constants
+
+class FrozenDict(dict):
+    """
+    dict that can't be changed. Reading is plain dict access
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Frozen configuration is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem \
+        = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # Rebuilt without __init__, which FrozenConfig needs a config for.
+        # Attributes such as flat are restored along with the values
+        return (_rebuild, (self.__class__, dict(self)), self.__dict__ or None)
+
+def _rebuild(clas, values):
+    frozen = clas.__new__(clas)
+    dict.update(frozen, values)
+    return frozen
+
+def frozen_value(value):
+    # Lists are given as tuples so nothing can be changed in place
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+class FrozenConfig(FrozenDict):
+    """
+    Values of every constant of a config, keyed by namespace, with
+    sections as nested FrozenDicts:
+
+        frozen["__local"]["db"]["host"]
+
+    The same values are in flat, keyed by fully qualified name:
+
+        frozen.flat["__local:db.host"]
+    """
+    def __init__(self, config):
+        generation = config._generation
+        sep = config.namespace_separator
+        flat, namespaces = {}, {}
+        # Sections first, so that their dicts are there for their constants
+        # whatever order the index is in
+        for name, constant in sorted(generation.index.items(),
+                key=lambda x: not isinstance(x[1], Constants)):
+            namespace, key = name.split(sep, 1)
+            if isinstance(constant, Constants):
+                value = {}
+            else:
+                try:
+                    value = frozen_value(constant.value)
+                except KeyError:
+                    # Broken reference. Same as get()
+                    value = None
+                flat[name] = value
+            path = key.split(Constants.namespace_separator)
+            section = namespaces.setdefault(namespace, {})
+            for part in path[:-1]:
+                section = section.setdefault(part, {})
+            section.setdefault(path[-1], value)
+        dict.__init__(self, ((namespace, self.freeze(section))
+            for namespace, section in namespaces.items()))
+        self.flat = FrozenDict(flat)
+
+    @classmethod
+    def freeze(cls, section):
+        return FrozenDict((key, cls.freeze(value)
+                if type(value) is dict else value)
+            for key, value in section.items())
@@ -1,22 +1,83 @@
 # encoding: utf-8
 
-# XXX Prefer pycrypto if available
-from .blowfish import Blowfish 
+from .fastblowfish import FastBlowfish, CryptographyBlowfish
+
+# Prefer the cryptography package if available
+if CryptographyBlowfish.available():
+    Blowfish = CryptographyBlowfish
+else:
+    Blowfish = FastBlowfish
 from xmlconfig import ContentProcessor, SimpleConstant, ContentDecoder
+from xmlconfig.cache import LRUCache
+from xmlconfig.stream import Stream
 import hashlib, hmac
 
 @SimpleConstant.register_processor(after=ContentDecoder)
 class EncryptedContent(ContentProcessor):
+    # Setting up a Blowfish key schedule takes 521 encryptions, and the
+    # content of no-cache constants is decrypted on every access. Keep the
+    # ciphers ready, keyed by the derived key, along with the derived keys
+    # themselves
+    ciphers = LRUCache(64)
+    keys = LRUCache(1024)
+
     def process(self, constant, content):
         if constant.has_option("salt"):
+            key = self.derive_key(constant.key, constant.options['salt'],
+                constant.namespace)
+            return self.cipher(key).decrypt(content)
+
+    def stream(self, constant, fp):
+        if not constant.has_option("salt"):
+            return fp
+        key = self.derive_key(constant.key, constant.options['salt'],
+            constant.namespace)
+        return DecryptingStream(fp, self.cipher(key))
+
+    def derive_key(self, key, salt, namespace):
+        derived = self.keys.get((key, salt, namespace))
+        if derived is None:
             # Key is an SHA1 hmac hash of the key attribute of the loaded 
             # document, the salt of this element, and the namespace
             # XXX Implement password of this config document
             # XXX Try and read encoding from XML document
-            key = hmac.new(constant.key.encode(), 
-                (constant.options['salt'] + constant.namespace).encode(), 
+            derived = self.keys[(key, salt, namespace)] = hmac.new(
+                key.encode(), (salt + namespace).encode(),
                 hashlib.sha1).digest()
-            return Blowfish(key).decrypt(content)
+        return derived
+
+    def cipher(self, key):
+        cipher = self.ciphers.get(key)
+        if cipher is None:
+            cipher = self.ciphers[key] = Blowfish(key)
+        return cipher
+
+class DecryptingStream(Stream):
+    """
+    Content of the source decrypted a chunk of whole blocks at a time. Null
+    bytes at the end of a chunk are held back, as they are only padding if
+    nothing else follows
+    """
+    def __init__(self, source, cipher):
+        super(DecryptingStream, self).__init__(source)
+        self.cipher = cipher
+
+    def chunks(self):
+        held, nulls = b"", b""
+        for chunk in self.source_chunks():
+            held += chunk
+            usable = len(held) - len(held) % 8
+            if not usable:
+                continue
+            data = self.cipher.decrypt(held[:usable])
+            held = held[usable:]
+            if data:
+                yield nulls + data
+                nulls = b""
+            nulls += b"\x00" * (usable - len(data))
+        if held:
+            # Not a whole block. Let the cipher complain about it
+            self.cipher.decrypt(held)
 
 # Lock / Unlock cli support
 from xml.dom.minidom import parse, Text
@@ -76,7 +137,8 @@ class ConstantLockUtility(CliCommand):
                             Blowfish(ekey).encrypt(y.data.strip().encode())).decode() \
                             + trailing
 
-                opt= Options({"options":x.getAttribute("options")})
+                opt= Options()
+                opt.merge({"options":x.getAttribute("options")})
 
                 # Drop unlocked option
                 del opt["unlocked"]
@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+"""
+Faster engines for Blowfish encryption with the same results as the pure
+Python Blowfish class, which is kept as the reference implementation.
+Both work in ECB mode, padding with (and stripping) null bytes.
+
+FastBlowfish is pure Python. Its rounds are unrolled with the round
+function inlined, the P-array and S-boxes are bound to locals, and the
+data is unpacked and packed in one go with struct rather than per block.
+The key schedule goes through the same cipher, so it is faster too.
+
+CryptographyBlowfish uses the cryptography package, if it is installed
+and its OpenSSL still provides Blowfish.
+"""
+
+import struct
+from .blowfish import Blowfish
+
+class FastBlowfish(Blowfish):
+
+    def __init__(self, key):
+        Blowfish.__init__(self, key)
+        # P-array in the order used by the rounds for each direction
+        self._encrypt_order = tuple(self.p_boxes)
+        self._decrypt_order = tuple(reversed(self.p_boxes))
+
+    def cipher(self, xl, xr, direction):
+        # Used for the key schedule, where the boxes change between calls
+        if direction == self.ENCRYPT:
+            p = self.p_boxes
+        else:
+            p = self.p_boxes[::-1]
+        return tuple(self._blocks((xl, xr), p))
+
+    def _blocks(self, words, p):
+        """
+        Runs the 64-bit blocks, given as pairs of 32-bit words, through
+        the rounds with the P-array in the order given (reversed to
+        decrypt). Two rounds per step leaves the halves where they
+        started, so there is no swapping.
+        """
+        s0, s1, s2, s3 = self.s_boxes
+        p0, p1, p2, p3, p4, p5, p6, p7, p8, p9, p10, p11, p12, p13, p14, \
+            p15, p16, p17 = p
+        M = 0xFFFFFFFF
+        out = []
+        append = out.append
+        for i in range(0, len(words), 2):
+            xl = words[i] ^ p0
+            xr = words[i+1] ^ (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p1
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p2
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p3
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p4
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p5
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p6
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p7
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p8
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p9
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p10
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p11
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p12
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p13
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            xl ^= p14
+            xr ^= (((s0[xl >> 24] + s1[xl >> 16 & 255]) ^ s2[xl >> 8 & 255]) + s3[xl & 255]) & M
+            xr ^= p15
+            xl ^= (((s0[xr >> 24] + s1[xr >> 16 & 255]) ^ s2[xr >> 8 & 255]) + s3[xr & 255]) & M
+            append(xr ^ p17)
+            append(xl ^ p16)
+        return out
+
+    def encrypt(self, data):
+        data = bytes(bytearray(data))
+        if len(data) % 8:
+            # pad null characters
+            data += b'\x00' * (8 - len(data) % 8)
+        format = ">{0}I".format(len(data) // 4)
+        return struct.pack(format,
+            *self._blocks(struct.unpack(format, data), self._encrypt_order))
+
+    def decrypt(self, data):
+        data = bytes(bytearray(data))
+        if len(data) % 8:
+            raise ValueError("Encrypted data must be a multiple of 8 bytes")
+        format = ">{0}I".format(len(data) // 4)
+        return struct.pack(format,
+            *self._blocks(struct.unpack(format, data), self._decrypt_order)
+            ).rstrip(b'\x00')
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, modes
+    try:
+        from cryptography.hazmat.decrepit.ciphers.algorithms import \
+            Blowfish as _Algorithm
+    except ImportError:
+        from cryptography.hazmat.primitives.ciphers.algorithms import \
+            Blowfish as _Algorithm
+except ImportError:
+    _Algorithm = None
+
+class CryptographyBlowfish(object):
+    def __init__(self, key):
+        self._cipher = Cipher(_Algorithm(bytes(bytearray(key))), modes.ECB())
+
+    def encrypt(self, data):
+        data = bytes(bytearray(data))
+        if len(data) % 8:
+            data += b'\x00' * (8 - len(data) % 8)
+        encryptor = self._cipher.encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+
+    def decrypt(self, data):
+        decryptor = self._cipher.decryptor()
+        return (decryptor.update(bytes(bytearray(data)))
+            + decryptor.finalize()).rstrip(b'\x00')
+
+    @classmethod
+    def available(cls):
+        """
+        True if the cryptography package is installed, provides Blowfish,
+        and agrees with the reference implementation
+        """
+        if _Algorithm is None:
+            return False
+        key, data = b"xmlconfig-check", b"The quick brown fox"
+        try:
+            return cls(key).encrypt(data) == Blowfish(key).encrypt(data)
+        except Exception:
+            # OpenSSL 3 only has Blowfish in its legacy provider
+            return False
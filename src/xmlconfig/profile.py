@@ -0,0 +1,96 @@
+# encoding: utf-8
+
+"""
+Records where the time goes while the content of constants is processed.
+Started with XmlConfig.start_profiling(); nothing is recorded otherwise.
+"""
+
+import threading
+from timeit import default_timer
+
+class Stats(object):
+    __slots__ = ('calls', 'time', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __repr__(self):
+        return "<Stats calls={0} time={1:.6f} in={2} out={3}>".format(
+            self.calls, self.time, self.bytes_in, self.bytes_out)
+
+def size(content):
+    try:
+        return len(content)
+    except TypeError:
+        return 0
+
+def qualified_name(constant):
+    "namespace:dotted.key of the constant the content belongs to"
+    # Sections and constants have keys, <choose> blocks and their
+    # elements don't. Stop short of the XmlConfig
+    keys = []
+    node = constant
+    while node.parent is not None:
+        if node.has_option('key'):
+            keys.append(node.options['key'])
+        node = node.parent
+    return "{0}{1}{2}".format(constant.namespace,
+        constant.namespace_separator, ".".join(reversed(keys)))
+
+class Profile(object):
+    """
+    Call counts, cumulative time and bytes in and out of each content
+    processor, by processor class and by namespace:key. Time is inclusive:
+    the ReferenceResolver of a constant includes the processing of the
+    constants it refers to, which are also counted under their own keys.
+    """
+    def __init__(self):
+        self.processors = {}
+        self.keys = {}
+        self._lock = threading.Lock()
+
+    def process(self, constant, processors, content):
+        "Run content through the processors, same as SimpleConstant.content"
+        name = None
+        for proc in processors:
+            start = default_timer()
+            T = proc.process(constant, content)
+            elapsed = default_timer() - start
+            if name is None:
+                name = qualified_name(constant)
+            out = content if T is None else T
+            self.record(proc.__class__.__name__, name, elapsed,
+                size(content), size(out))
+            content = out
+        return content
+
+    def record(self, processor, key, elapsed, bytes_in, bytes_out):
+        with self._lock:
+            for table, name in ((self.processors, processor),
+                    (self.keys, key)):
+                stats = table.get(name)
+                if stats is None:
+                    stats = table[name] = Stats()
+                stats.calls += 1
+                stats.time += elapsed
+                stats.bytes_in += bytes_in
+                stats.bytes_out += bytes_out
+
+    def report(self, limit=20):
+        "Text table of the processors and the slowest keys"
+        lines = []
+        for title, table in (("processor", self.processors),
+                ("key", self.keys)):
+            lines.append("{0:<40}{1:>8}{2:>12}{3:>12}{4:>12}".format(
+                title, "calls", "time (ms)", "bytes in", "bytes out"))
+            ranked = sorted(table.items(), key=lambda x: x[1].time,
+                reverse=True)
+            for name, stats in ranked[:limit]:
+                lines.append("{0:<40}{1:>8}{2:>12.3f}{3:>12}{4:>12}".format(
+                    name, stats.calls, stats.time * 1e3, stats.bytes_in,
+                    stats.bytes_out))
+            lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,87 @@
+# encoding: utf-8
+
+"""
+On-disk snapshots of parsed config documents. A snapshot holds the stream
+of parse events recorded for a document (see EventRecorder) along with the
+last-modified header and a hash of the document source. When a document is
+loaded and neither has changed, the events are replayed straight into the
+config handlers and the XML parser is skipped entirely.
+
+Imported documents are loaded through XmlConfig.load like any other, so
+each import gets (and is checked against) its own snapshot.
+"""
+
+import os, sys, marshal, hashlib, tempfile
+from io import BytesIO, StringIO
+
+class SnapshotCache(object):
+    # Bump if the event format changes. marshal output is only guaranteed
+    # to be readable by the same Python version, so that is checked too
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, url):
+        return os.path.join(self.path,
+            hashlib.sha1(url.encode()).hexdigest() + ".snapshot")
+
+    def load(self, config, content, url, namespace):
+        data = content.read()
+        if type(data) is bytes:
+            digest = hashlib.sha1(data).hexdigest()
+            source = BytesIO(data)
+        else:
+            digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+            source = StringIO(data)
+        modified = content.headers.get('last-modified')
+
+        events = self.get(url, modified, digest)
+        if events is not None:
+            self.hits += 1
+            config.replay(events, namespace)
+        else:
+            self.misses += 1
+            events = config.parse(source, namespace, record=True)
+            self.put(url, modified, digest, events)
+
+    def get(self, url, modified, digest):
+        try:
+            with open(self.filename(url), 'rb') as f:
+                snapshot = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            # Missing or unreadable. Either way, parse the document
+            return None
+        if type(snapshot) is not dict \
+                or snapshot.get('version') != self.key() \
+                or snapshot.get('url') != url \
+                or snapshot.get('last-modified') != modified \
+                or snapshot.get('digest') != digest:
+            return None
+        return snapshot['events']
+
+    def put(self, url, modified, digest, events):
+        snapshot = {
+            'version':          self.key(),
+            'url':              url,
+            'last-modified':    modified,
+            'digest':           digest,
+            'events':           events
+        }
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # Write to a temporary file and move it into place so that other
+        # processes never see a partial snapshot
+        fd, temp = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(snapshot, f)
+            os.rename(temp, self.filename(url))
+        except:
+            os.unlink(temp)
+            raise
+
+    def key(self):
+        return "{0}-{1}.{2}".format(self.version, *sys.version_info[:2])
@@ -0,0 +1,167 @@
+# encoding: utf-8
+
+"""
+File-like objects working out the content of a constant a chunk at a time
+as it is read, for SimpleConstant.open(). Each content processor wraps the
+stream of the one before with a stream() of its own.
+"""
+
+import codecs
+from io import BytesIO, StringIO
+
+def memory_file(content):
+    "File-like object reading content already in memory"
+    if isinstance(content, memoryview):
+        return MemoryReader(content)
+    elif type(content) is bytes:
+        return BytesIO(content)
+    return StringIO(content)
+
+class Stream(object):
+    """
+    File-like object reading the chunks given by the chunks() method of a
+    subclass, which works them out from what it reads from source
+    """
+    chunk_size = 1 << 16
+
+    def __init__(self, source):
+        self.source = source
+        self._chunks = None
+        self._held = None
+        # What reading at the end gives, bytes or text like the chunks
+        self._empty = b""
+
+    def chunks(self):
+        raise NotImplementedError()
+
+    def source_chunks(self):
+        "Chunks read from the source"
+        while True:
+            chunk = self.source.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def read(self, size=-1):
+        if self._chunks is None:
+            self._chunks = self.chunks()
+        pieces, length = [], 0
+        if self._held:
+            pieces.append(self._held)
+            length = len(self._held)
+            self._held = None
+        while size is None or size < 0 or length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            pieces.append(chunk)
+            length += len(chunk)
+        if not pieces:
+            return self._empty
+        self._empty = pieces[0][:0]
+        data = self._empty.join(pieces)
+        if size is not None and 0 <= size < len(data):
+            data, self._held = data[:size], data[size:]
+        return data
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MemoryReader(object):
+    "Reads a memoryview without copying more than is asked for"
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.position
+        if size is None or size < 0:
+            self.position = len(self.view)
+        else:
+            self.position = min(start + size, len(self.view))
+        return self.view[start:self.position].tobytes()
+
+    def close(self):
+        pass
+
+class StrippedStream(Stream):
+    "Content of the source without leading and trailing whitespace"
+    def chunks(self):
+        started, pending = False, None
+        for chunk in self.source_chunks():
+            if not started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+            stripped = chunk.rstrip()
+            if not stripped:
+                # Only trailing if nothing but whitespace follows
+                pending = chunk if pending is None else pending + chunk
+                continue
+            if pending:
+                yield pending
+            yield stripped
+            pending = chunk[len(stripped):]
+
+class DecodingStream(Stream):
+    """
+    Content of the source decoded with a bytes-to-bytes codec that decodes
+    blocks of a fixed number of characters independently, such as base64.
+    Whitespace in the source is ignored
+    """
+    block_sizes = {"base64": 4, "hex": 2}
+
+    def __init__(self, source, decoder, block_size):
+        super(DecodingStream, self).__init__(source)
+        self.decoder = decoder
+        self.block_size = block_size
+
+    def chunks(self):
+        held = b""
+        for chunk in self.source_chunks():
+            if type(chunk) is not bytes:
+                chunk = chunk.encode()
+            held += b"".join(chunk.split())
+            usable = len(held) - len(held) % self.block_size
+            if usable:
+                yield self.decoder(held[:usable])[0]
+                held = held[usable:]
+        if held:
+            # Let the codec complain about it
+            yield self.decoder(held)[0]
+
+    @classmethod
+    def block_size_of(cls, encoding):
+        "Size of the blocks of the encoding, None if it can't be streamed"
+        try:
+            name = codecs.lookup(encoding).name
+        except LookupError:
+            return None
+        return cls.block_sizes.get(name.replace("_codec", ""))
+
+class TextStream(Stream):
+    "Content of the source decoded from utf-8 to text"
+    def chunks(self):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in self.source_chunks():
+            if type(chunk) is bytes:
+                chunk = decoder.decode(chunk)
+            if chunk:
+                yield chunk
+        tail = decoder.decode(b"", True)
+        if tail:
+            yield tail
@@ -0,0 +1,177 @@
+# encoding: utf-8
+
+"""
+Watches the documents loaded into a config and reloads the ones that
+change. Local files are watched with inotify on Linux, and by polling
+their modification times elsewhere. Other urls are polled every interval,
+which is cheap for http(s) as the requests are conditional.
+"""
+
+import os, sys, struct, select, threading, ctypes, ctypes.util
+from xmlconfig import EventHook, urlparse
+
+if sys.version_info >= (3,0):
+    from urllib.request import url2pathname
+else:
+    from urllib import url2pathname
+
+def local_path(url):
+    "Path of the file for a file: url, or None for other urls"
+    parts = urlparse(url)
+    if parts.scheme != 'file':
+        return None
+    return os.path.abspath(url2pathname(parts.path))
+
+class PollingWatcher(threading.Thread):
+    def __init__(self, config, interval=1.0):
+        super(PollingWatcher, self).__init__()
+        self.daemon = True
+        self.config = config
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._stats = {}
+        # Errors raised while reloading. The watcher keeps going
+        self.on_error = EventHook()
+
+    def stop(self):
+        self._stopped.set()
+        if self is not threading.current_thread():
+            self.join()
+
+    def run(self):
+        # Start from the files as they are now
+        self.changed_files()
+        while not self._stopped.is_set():
+            for url, force in self.wait():
+                if self._stopped.is_set():
+                    break
+                try:
+                    self.config.reload(url, force)
+                except Exception as ex:
+                    self.on_error.fire(url, ex)
+
+    def wait(self):
+        """
+        Wait for something to change and return (url, force) for the
+        documents to reload. Files known to have changed are forced, since
+        the last-modified time is only kept to the second. Remote urls are
+        left to decide for themselves.
+        """
+        self._stopped.wait(self.interval)
+        return [(url, True) for url in self.changed_files()] \
+            + [(url, False) for url in self.remote_urls()]
+
+    def changed_files(self):
+        changed = []
+        for url in list(self.config._files):
+            path = local_path(url)
+            if path is None:
+                continue
+            try:
+                st = os.stat(path)
+                stat = (st.st_mtime, st.st_size, st.st_ino)
+            except OSError:
+                # Gone missing. It may be in the middle of being replaced
+                continue
+            if url in self._stats and self._stats[url] != stat:
+                changed.append(url)
+            self._stats[url] = stat
+        return changed
+
+    def remote_urls(self):
+        return [url for url in list(self.config._files)
+            if local_path(url) is None]
+
+# inotify(7) support through libc
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_NONBLOCK     = os.O_NONBLOCK
+IN_CLOEXEC      = 0o2000000
+
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.inotify_init1
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_uint32]
+    except (OSError, AttributeError):
+        _libc = None
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Watches the folders of the loaded files, rather than the files, so
+    that files replaced by editors (written elsewhere and renamed into
+    place) are still seen.
+    """
+    event_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO \
+        | IN_CREATE
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, config, interval=1.0):
+        super(InotifyWatcher, self).__init__(config, interval)
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders = {}
+
+    def run(self):
+        try:
+            super(InotifyWatcher, self).run()
+        finally:
+            os.close(self._fd)
+
+    def wait(self):
+        self.watch_folders()
+        ready = select.select([self._fd], [], [], self.interval)[0]
+        names = set()
+        if ready:
+            names = self.read_events()
+        # Only reload files that actually changed. Editors may touch the
+        # folder in other ways
+        changed = [url for url in self.changed_files()
+            if local_path(url) in names]
+        return [(url, True) for url in changed] \
+            + [(url, False) for url in self.remote_urls()]
+
+    def watch_folders(self):
+        for url in list(self.config._files):
+            path = local_path(url)
+            if path is None:
+                continue
+            folder = os.path.dirname(path)
+            if folder in self._folders.values():
+                continue
+            wd = _libc.inotify_add_watch(self._fd,
+                folder.encode(sys.getfilesystemencoding()), self.event_mask)
+            if wd >= 0:
+                self._folders[wd] = folder
+
+    def read_events(self):
+        names = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError:
+            return names
+        i = 0
+        while i + self.event_header.size <= len(data):
+            wd, mask, cookie, length = self.event_header.unpack_from(data, i)
+            i += self.event_header.size
+            name = data[i:i + length].rstrip(b'\0')
+            i += length
+            if wd in self._folders and name:
+                names.add(os.path.join(self._folders[wd],
+                    name.decode(sys.getfilesystemencoding())))
+        return names
+
+def create_watcher(config, interval=1.0):
+    if _libc is not None:
+        try:
+            return InotifyWatcher(config, interval)
+        except OSError:
+            # Out of inotify instances, probably
+            pass
+    return PollingWatcher(config, interval)
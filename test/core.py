@@ -36,3 +36,400 @@ def testGetDefault():
     conf.parse(getConfigFile1(), LOCAL_NAMESPACE)
     assert conf.get("key1") == "string"
     assert conf.get("key2","default") == "default"
+
+def testLookupIndex():
+    "Keys added by later documents and nested sections should be found"
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    conf=getConfig()
+    conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <section key="indexed">
+                <section key="deeper">
+                    <string key="key">indexed value</string>
+                </section>
+            </section>
+        </constants>
+        <constants namespace="other">
+            <int key="indexed">42</int>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    assert conf.get("indexed.deeper.key") == "indexed value"
+    assert conf.get(LOCAL_NAMESPACE + ":indexed.deeper.key") == "indexed value"
+    assert conf.get("other:indexed") == 42
+    assert conf.get("indexed.deeper.missing") is None
+
+def testProfiling():
+    "Content processing should be profiled per processor and key"
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    conf=getConfig("profiled")
+    conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <section key="profiled">
+                <string key="encoded" encoding="base64">UHJvZmlsZWQ=</string>
+            </section>
+            <string key="plain">Not profiled</string>
+            <string key="referring">%(profiled.encoded) text</string>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    assert conf.get("plain") == "Not profiled"
+    profile = conf.start_profiling()
+    assert conf.get("referring") == "Profiled text"
+    assert conf.stop_profiling() is profile
+    assert conf.get("profiled.encoded") == "Profiled"
+
+    encoded = profile.keys[LOCAL_NAMESPACE + ":profiled.encoded"]
+    assert encoded.calls == len(conf.documents[LOCAL_NAMESPACE]
+        .constants[LOCAL_NAMESPACE]["profiled"]["encoded"].content_processors)
+    # Processors that leave the content alone still see it go through
+    decoder = profile.processors["ContentDecoder"]
+    assert decoder.calls == 2
+    assert decoder.bytes_in - decoder.bytes_out == len("UHJvZmlsZWQ=") - 8
+    assert LOCAL_NAMESPACE + ":plain" not in profile.keys
+    assert "ReferenceResolver" in profile.report()
+
+def testExpatEngine():
+    "The expat engine should build the same constants as the SAX parser"
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    document = u"""<?xml version="1.0" encoding="utf-8"?>
+    <!-- Comments and entities are handled by the parser -->
+    <config>
+        <constants>
+            <string key="engine">Fish &amp; chips</string>
+            <list key="engine-list"><![CDATA[a, <b>,]]> c</list>
+            <section key="engine-section">
+                <int key="answer">42</int>
+                <string key="chosen">
+                    <choose>
+                        <default>default</default>
+                        <when test="1 == 1">chosen</when>
+                    </choose>
+                </string>
+            </section>
+        </constants>
+        <constants namespace="engine-ns">
+            <string key="engine-ref">%(engine) for %(engine-section.answer)</string>
+        </constants>
+        <constants>
+            <string key="engine-ref">%(engine) for %(engine-section.answer)</string>
+        </constants>
+    </config>
+    """
+    configs = []
+    for engine in ("sax", "expat"):
+        conf=getConfig("engine-" + engine)
+        conf.parse(stringIOWrapper(document), LOCAL_NAMESPACE, engine=engine)
+        configs.append(conf)
+    sax, expat = [dict((name, (type(constant), constant.signature))
+        for name, constant in conf._generation.index.items())
+        for conf in configs]
+    assert sax == expat
+    assert configs[1].get("engine-list") == ["a", "<b>", "c"]
+    assert configs[1].get("engine-section.chosen") == "chosen"
+    assert configs[1].get("engine-ref") == "Fish & chips for 42"
+
+def testCompactConstants():
+    "Constants should have no __dict__ and create event hooks on demand"
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    conf=getConfig()
+    conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <int key="compact">7</int>
+            <string key="compact-choice">
+                <choose>
+                    <default>default</default>
+                    <when test="1 == 2">never</when>
+                </choose>
+            </string>
+            <string key="compact-choice2">
+                <choose>
+                    <default>default</default>
+                    <when test="1 == 2">never</when>
+                </choose>
+            </string>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    index = conf._generation.index
+    constant = index[LOCAL_NAMESPACE + ":compact"]
+    assert not hasattr(constant, "__dict__")
+    assert constant._on_update is None
+    assert constant.on_update is constant.on_update
+    assert constant.options["key"] == "compact"
+    assert constant.value == 7
+    # Elements declared alike share their options
+    first, second = [index[LOCAL_NAMESPACE + ":" + key].children[0]
+        for key in ("compact-choice", "compact-choice2")]
+    assert first.options is second.options
+    assert conf.get("compact-choice2") == "default"
+
+def testGetMany():
+    "Several keys and whole sections should be read in one call"
+    import os
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    conf=getConfig()
+    conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="many-name">many</string>
+            <section key="many-db">
+                <string key="host">db.local</string>
+                <int key="port">5432</int>
+                <section key="pool">
+                    <list key="sizes" type="int">1,2</list>
+                </section>
+            </section>
+        </constants>
+        <constants namespace="many-ns">
+            <boolean key="flag">true</boolean>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    assert conf.get_many(["many-name", "many-db.port", "many-ns:flag",
+        "many-missing"], {"many-missing": "default"}) == {
+            "many-name": "many", "many-db.port": 5432, "many-ns:flag": True,
+            "many-missing": "default"}
+    db = {"host": "db.local", "port": 5432, "pool": {"sizes": [1, 2]}}
+    assert conf.section_dict("many-db") == db
+    assert conf.section_dict(LOCAL_NAMESPACE + ":many-db") == db
+    assert conf.get_many(["many-db"]) == {"many-db": db}
+    os.environ["many_var"] = "from the environment"
+    assert conf.get_many(["env:many_var", "many-name"]) == {
+        "env:many_var": "from the environment", "many-name": "many"}
+    assert conf.get("env:many_var") == "from the environment"
+
+def testFreeze():
+    "Frozen configs should hold plain values that can't be changed"
+    import copy, operator, pickle
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    conf=getConfig("frozen")
+    conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="name">frozen</string>
+            <section key="db">
+                <int key="port">5432</int>
+                <section key="pool">
+                    <list key="sizes" type="int">1,2</list>
+                </section>
+            </section>
+            <bytes key="raw" encoding="base64">UmF3</bytes>
+            <string key="ref">%(name) %(db.port)</string>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    frozen = conf.freeze()
+    local = frozen[LOCAL_NAMESPACE]
+    assert local["name"] == "frozen"
+    assert local["db"]["port"] == 5432
+    assert local["db"]["pool"]["sizes"] == (1, 2)
+    assert local["raw"] == b"Raw"
+    assert local["ref"] == "frozen 5432"
+    assert frozen.flat[LOCAL_NAMESPACE + ":db.pool.sizes"] == (1, 2)
+    for mapping in (frozen, local, local["db"], frozen.flat):
+        for change in (lambda: mapping.__setitem__("changed", True),
+                lambda: operator.ior(mapping, {"changed": True})):
+            try:
+                change()
+            except TypeError:
+                pass
+            else:
+                raise AssertionError("Frozen mapping was changed")
+        assert "changed" not in mapping
+
+    # Pickles and copies are frozen too, and of the same class
+    for copied in (pickle.loads(pickle.dumps(frozen)), copy.copy(frozen)):
+        assert type(copied) is type(frozen)
+        assert copied == frozen
+        assert copied.flat == frozen.flat
+        assert type(copied[LOCAL_NAMESPACE]["db"]) is type(local["db"])
+
+def testCodegen():
+    "Generated classes should give typed attribute access to the config"
+    from decimal import Decimal
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    from xmlconfig.codegen import generate
+    conf=getConfig("codegen")
+    def parse(port):
+        conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="name">generated</string>
+                <section key="db">
+                    <int key="port">{0}</int>
+                    <boolean key="ssl-only">true</boolean>
+                </section>
+            </constants>
+        </config>
+        """.format(port)), LOCAL_NAMESPACE)
+    parse(5432)
+    module = {}
+    exec(compile(generate(conf), "<codegen>", "exec"), module)
+    Config = module["Config"]
+    settings = Config.load(conf)
+    assert settings.name == "generated"
+    assert settings.db.port == 5432
+    assert settings.db.ssl_only is True
+    assert Config.__types__["db"] is module["Db"]
+    assert module["Db"].__types__ == {"port": int, "ssl_only": bool}
+    binding = Config.bind(conf)
+    assert binding.current.db.port == 5432
+    parse(6543)
+    assert binding.current.db.port == 6543
+
+    # Keys named like what the generated classes have themselves
+    clash=getConfig("codegen-clash")
+    clash.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="load">eager</string>
+            <string key="bind">0.0.0.0</string>
+            <string key="namespace">clashing</string>
+            <section key="db">
+                <string key="__slots__">slotted</string>
+            </section>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    module = {}
+    exec(compile(generate(clash), "<codegen>", "exec"), module)
+    settings = module["Config"].load(clash)
+    assert settings.load_ == "eager"
+    assert settings.bind_ == "0.0.0.0"
+    assert settings.namespace == "clashing"
+    assert settings.db.__slots___ == "slotted"
+    assert module["Config"].bind(clash).current.bind_ == "0.0.0.0"
+
+    # Sections named like what the generated module uses itself
+    clash=getConfig("codegen-module-clash")
+    clash.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <decimal key="rate">1.5</decimal>
+            <section key="accessors">
+                <string key="name">accessed</string>
+            </section>
+            <section key="decimal">
+                <float key="scale">0.25</float>
+            </section>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    module = {}
+    exec(compile(generate(clash), "<codegen>", "exec"), module)
+    Config = module["Config"]
+    settings = Config.load(clash)
+    assert settings.accessors.name == "accessed"
+    assert settings.decimal.scale == Decimal("0.25")
+    assert settings.rate == Decimal("1.5")
+    assert Config.__types__["rate"] is Decimal
+    assert Config.__types__["decimal"] is module["Decimal_"]
+    assert module["Decimal_"].__types__ == {"scale": Decimal}
+    assert Config.__types__["accessors"] is module["Accessors_"]
+
+def testConcurrentReads():
+    "Threads reading constants for the first time should agree on them"
+    import base64, threading
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    conf=getConfig("concurrent-reads")
+    conf.parse(stringIOWrapper(u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            {0}
+        </constants>
+    </config>
+    """.format("".join(
+        u'<bytes key="read{0}" encoding="base64">{1}</bytes>'.format(i,
+            base64.b64encode("Read {0}".format(i).encode()).decode())
+        for i in range(5000)))), LOCAL_NAMESPACE)
+    start, errors = threading.Event(), []
+    def read():
+        start.wait()
+        try:
+            for i in range(5000):
+                assert conf.get("read{0}".format(i)) == \
+                    "Read {0}".format(i).encode()
+        except Exception as ex:
+            errors.append(ex)
+    switching = getattr(sys, 'getswitchinterval', None)
+    if switching is not None:
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+    try:
+        readers = [threading.Thread(target=read) for x in range(8)]
+        for x in readers:
+            x.start()
+        start.set()
+        for x in readers:
+            x.join()
+    finally:
+        if switching is not None:
+            sys.setswitchinterval(interval)
+    assert errors == []
+
+def testContentCache():
+    "The content cache should hold no more than its size in bytes"
+    from xmlconfig.cache import ContentCache
+    cache = ContentCache(maxbytes=10)
+    cache["a"] = ({}, b"12345", 0)
+    cache["b"] = ({}, b"1234", 0)
+    assert cache.bytes == 9
+    cache.get("a")
+    # b is the least recently used
+    cache["c"] = ({}, b"12", 0)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.bytes == 7
+    cache["big"] = ({}, b"12345678901", 0)
+    assert "big" not in cache and cache.bytes == 7
+    del cache["a"]
+    assert cache.bytes == 2
+    assert cache.pop("c") == ({}, b"12", 0)
+    assert cache.pop("c") is None and cache.bytes == 0
+
+def testMappedBytes():
+    "bytes with the mmap option should be read-only views of the file"
+    import os, shutil, tempfile, xmlconfig
+    from xmlconfig import XmlConfig
+    if sys.version_info >= (3,0):
+        from urllib.request import urlopen
+    else:
+        from urllib2 import urlopen
+    path = tempfile.mkdtemp()
+    data = b"\n\x00model\xff \n"
+    with open(os.path.join(path, "model.bin"), "wb") as f:
+        f.write(data)
+    with open(os.path.join(path, "mapped.xml"), "w") as f:
+        f.write(u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <bytes key="model" src="model.bin" options="mmap"/>
+                <bytes key="same" src="model.bin" options="mmap"/>
+                <bytes key="encoded" src="model.bin"
+                    options="mmap;encoding:base64"/>
+            </constants>
+        </config>
+        """)
+    # The testImport module replaces urlopen with a mock
+    mocked, xmlconfig.urlopen = xmlconfig.urlopen, urlopen
+    try:
+        conf = XmlConfig("mapped")
+        conf.load("file:" + os.path.join(path, "mapped.xml"))
+        model = conf.get("model")
+        assert isinstance(model, memoryview) and model.readonly
+        # Used as it is, whitespace and all
+        assert model.tobytes() == data
+        assert conf.get("same") is model
+        try:
+            conf.get("encoded")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Mapped content was decoded")
+        del model
+    finally:
+        xmlconfig.urlopen = mocked
+        shutil.rmtree(path)
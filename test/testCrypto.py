@@ -0,0 +1,96 @@
+# encoding: utf-8
+
+import sys
+sys.path.append(sys.path.insert(0,"../src"))
+
+import os, random
+
+def checkEngine(engine):
+    from xmlconfig.plugins.crypto.blowfish import Blowfish
+    rng = random.Random(448)
+    for x in range(20):
+        key = bytes(bytearray(rng.randint(0, 255)
+            for y in range(rng.randint(8, 56))))
+        data = bytes(bytearray(rng.randint(1, 255)
+            for y in range(rng.randint(1, 100))))
+        reference, fast = Blowfish(key), engine(key)
+        encrypted = reference.encrypt(data)
+        assert fast.encrypt(data) == encrypted
+        assert fast.decrypt(encrypted) == reference.decrypt(encrypted) == data
+
+def testFastBlowfish():
+    "The fast Blowfish engine should match the reference implementation"
+    from xmlconfig.plugins.crypto import FastBlowfish
+    checkEngine(FastBlowfish)
+
+def testCryptographyBlowfish():
+    "The cryptography package should match the reference implementation"
+    from xmlconfig.plugins.crypto import CryptographyBlowfish
+    if CryptographyBlowfish.available():
+        checkEngine(CryptographyBlowfish)
+
+def testCipherCache():
+    "Decrypting again should reuse the derived key and key schedule"
+    from base64 import standard_b64encode
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    from xmlconfig.plugins.crypto import EncryptedContent, Blowfish
+    from core import stringIOWrapper
+    key = EncryptedContent().derive_key("cached-secret", "c2FsdHk=",
+        LOCAL_NAMESPACE)
+    encrypted = standard_b64encode(Blowfish(key).encrypt(b"Cached")).decode()
+    conf=getConfig()
+    conf.parse(stringIOWrapper(
+    u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="cached-secret"
+                options="salt:c2FsdHk=;encoding:base64;no-cache">{0}</string>
+        </constants>
+    </config>
+    """.format(encrypted)), LOCAL_NAMESPACE)
+    assert conf.get("cached-secret") == "Cached"
+    hits = EncryptedContent.ciphers.hits, EncryptedContent.keys.hits
+    assert conf.get("cached-secret") == "Cached"
+    assert (EncryptedContent.ciphers.hits, EncryptedContent.keys.hits) \
+        == (hits[0] + 1, hits[1] + 1)
+
+def testStreamedDecryption():
+    "Content read from open() should be decrypted a few blocks at a time"
+    from base64 import encodebytes
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    from xmlconfig.plugins.crypto import EncryptedContent, Blowfish
+    from xmlconfig.stream import Stream
+    from core import stringIOWrapper
+    # Nulls at the end of a block are only padding at the very end
+    data = b"streamed" + b"\x00" * 8 + b"0123456789" * 20
+    key = EncryptedContent().derive_key("streamed-secret", "c2FsdHk=",
+        LOCAL_NAMESPACE)
+    encrypted = encodebytes(Blowfish(key).encrypt(data)).decode()
+    conf=getConfig()
+    conf.parse(stringIOWrapper(
+    u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <bytes key="streamed-secret"
+                options="salt:c2FsdHk=;encoding:base64">
+                {0}
+            </bytes>
+        </constants>
+    </config>
+    """.format(encrypted)), LOCAL_NAMESPACE)
+    constant = conf.lookup("streamed-secret")
+    chunk_size, Stream.chunk_size = Stream.chunk_size, 5
+    try:
+        fp = constant.open()
+        chunks = []
+        while True:
+            chunk = fp.read(3)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        fp.close()
+    finally:
+        Stream.chunk_size = chunk_size
+    assert max(len(x) for x in chunks) == 3
+    assert b"".join(chunks) == data
+    assert conf.get("streamed-secret") == data
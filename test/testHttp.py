@@ -0,0 +1,350 @@
+# encoding: utf-8
+
+import sys
+sys.path.append(sys.path.insert(0,"../src"))
+
+# Documents and content served over http from a local stand-in server
+import hashlib, os, shutil, tempfile, threading
+from functools import partial
+from io import BytesIO
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.request import urlopen
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    # Allow keep-alive connections
+    protocol_version = "HTTP/1.1"
+
+    def send_response(self, code, message=None):
+        # Keep track of what was requested and how it was answered
+        self.server.responses.append((self.path, code))
+        SimpleHTTPRequestHandler.send_response(self, code, message)
+
+    def log_message(self, *args):
+        pass
+
+class EtagOnlyHandler(StandInHandler):
+    "Validates with ETags alone, without Last-Modified"
+    def send_head(self):
+        try:
+            with open(self.translate_path(self.path), 'rb') as f:
+                data = f.read()
+        except IOError:
+            self.send_error(404)
+            return None
+        etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return None
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return BytesIO(data)
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class HttpStandIn(object):
+    "Serves the files given over http on localhost from a temporary folder"
+    def __init__(self, files, handler=StandInHandler):
+        self.path = tempfile.mkdtemp()
+        for name, content in files.items():
+            self.publish(name, content)
+        self.server = StandInServer(("127.0.0.1", 0),
+            partial(handler, directory=self.path))
+        self.server.responses = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        # The testImport module replaces urlopen with a mock
+        import xmlconfig
+        self._urlopen, xmlconfig.urlopen = xmlconfig.urlopen, urlopen
+
+    def publish(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(content)
+
+    def url(self, name):
+        return "http://127.0.0.1:{0}/{1}".format(
+            self.server.server_address[1], name)
+
+    @property
+    def responses(self):
+        return self.server.responses
+
+    def close(self):
+        import xmlconfig
+        xmlconfig.urlopen = self._urlopen
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+def testConditionalReload():
+    "Unchanged documents and content should be revalidated, not transferred"
+    from xmlconfig import getConfig
+    server = HttpStandIn({
+        "http.xml": u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="local">Served over http</string>
+                <string key="sourced" src="content.txt" options="no-cache"/>
+            </constants>
+        </config>
+        """,
+        "content.txt": u"Sourced over http"
+    })
+    try:
+        conf=getConfig("http-conditional")
+        loads = []
+        conf.on_load += lambda url, namespace: loads.append(url)
+        conf.load(server.url("http.xml"))
+        conf.load(server.url("http.xml"))
+        assert len(loads) == 1
+        assert server.responses[-1] == ("/http.xml", 304)
+        assert conf.get("local") == "Served over http"
+
+        assert conf.get("sourced") == "Sourced over http"
+        assert conf.get("sourced") == "Sourced over http"
+        assert server.responses[-1] == ("/content.txt", 304)
+    finally:
+        server.close()
+
+def testEtagReload():
+    "Documents of servers giving only ETags should reload when changed"
+    import asyncio
+    from xmlconfig import getConfig
+    document = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="a">{0}</string>
+            </constants>
+        </config>
+        """
+    server = HttpStandIn({"etag.xml": document.format("First")},
+        EtagOnlyHandler)
+    try:
+        conf=getConfig("http-etag")
+        conf.load(server.url("etag.xml"))
+        assert conf.get("a") == "First"
+
+        server.publish("etag.xml", document.format("Second"))
+        conf.reload()
+        assert [x[1] for x in server.responses] == [200, 200]
+        assert conf.get("a") == "Second"
+        conf.reload()
+        assert server.responses[-1] == ("/etag.xml", 304)
+
+        server.publish("etag.xml", document.format("Third"))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(conf.areload())
+        finally:
+            loop.close()
+        assert conf.get("a") == "Third"
+    finally:
+        server.close()
+
+def testAsyncLoad():
+    "aload() should fetch everything up front and areload() what changed"
+    import asyncio, time
+    from xmlconfig import getConfig
+    server = HttpStandIn({
+        "async.xml": u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants namespace="part" src="async-part.xml"/>
+            <constants>
+                <string key="local">Served over http</string>
+                <string key="sourced" src="async.txt"/>
+            </constants>
+        </config>
+        """,
+        "async-part.xml": u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <int key="version">1</int>
+            </constants>
+        </config>
+        """,
+        "async.txt": u"Sourced over http"
+    })
+    try:
+        conf=getConfig("http-async")
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(conf.aload(server.url("async.xml")))
+            fetched = sorted(server.responses)
+            assert fetched == [("/async-part.xml", 200), ("/async.txt", 200),
+                ("/async.xml", 200)]
+            assert conf.get("part:version") == 1
+            assert conf.get("sourced") == "Sourced over http"
+            # Sourced content was fetched ahead of time
+            assert len(server.responses) == 3
+
+            server.publish("async-part.xml", u"""<?xml version="1.0"?>
+            <config>
+                <constants>
+                    <int key="version">2</int>
+                </constants>
+            </config>
+            """)
+            later = time.time() + 10
+            os.utime(os.path.join(server.path, "async-part.xml"),
+                (later, later))
+            updated = []
+            conf.on_update += updated.append
+            del server.responses[:]
+            loop.run_until_complete(conf.areload())
+            assert ("/async.xml", 304) in server.responses
+            assert ("/async-part.xml", 200) in server.responses
+            assert conf.get("part:version") == 2
+            assert updated == ["part:version"]
+        finally:
+            loop.close()
+    finally:
+        server.close()
+
+def testPooledFetcher():
+    "Pooled fetches should share a few keep-alive connections to the host"
+    from xmlconfig import getConfig
+    from xmlconfig.fetch import PooledFetcher
+    files = {"content{0}.txt".format(i): u"Content {0}".format(i)
+        for i in range(20)}
+    files["pooled.xml"] = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                {0}
+            </constants>
+        </config>
+        """.format("".join(
+            u'<string key="content{0}" src="content{0}.txt"/>'.format(i)
+            for i in range(20)))
+    server = HttpStandIn(files)
+    try:
+        conf=getConfig("http-pooled")
+        conf.fetcher = PooledFetcher(connections=2)
+        conf.load(server.url("pooled.xml"), workers=8)
+        for i in range(20):
+            assert conf.get("content{0}".format(i)) == "Content {0}".format(i)
+        stats = conf.fetcher.total()
+        assert stats.requests == 21
+        assert stats.connections <= 2
+        assert stats.bytes == sum(len(x) for x in files.values())
+
+        conf.load(server.url("pooled.xml"))
+        assert server.responses[-1] == ("/pooled.xml", 304)
+        assert conf.fetcher.total().connections <= 2
+        conf.fetcher.close()
+    finally:
+        server.close()
+
+def testPooledImportChain():
+    "Imports nested deeper than the pooled connections should not hang"
+    from xmlconfig import getConfig
+    from xmlconfig.fetch import PooledFetcher
+    # Each document imports the next, and refers to its constant
+    template = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants namespace="next" src="chain{0}.xml"/>
+            <constants>
+                <string key="name">%(next:name)</string>
+            </constants>
+        </config>
+        """
+    files = dict(("chain{0}.xml".format(i), template.format(i + 1))
+        for i in range(3))
+    files["chain3.xml"] = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="name">End of the chain</string>
+            </constants>
+        </config>
+        """
+    server = HttpStandIn(files)
+    try:
+        conf=getConfig("http-pooled-chain")
+        conf.fetcher = PooledFetcher(connections=2)
+        loader = threading.Thread(target=conf.load,
+            args=(server.url("chain0.xml"),))
+        loader.daemon = True
+        loader.start()
+        loader.join(10)
+        assert not loader.is_alive()
+        assert conf.get("name") == "End of the chain"
+        conf.fetcher.close()
+    finally:
+        server.close()
+
+def testContentTtl():
+    "Content with a ttl should be reused until it expires, then revalidated"
+    from xmlconfig import getConfig
+    server = HttpStandIn({
+        "ttl.xml": u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="sourced" src="ttl.txt" options="ttl:60"/>
+                <string key="plain" src="ttl.txt"/>
+            </constants>
+        </config>
+        """,
+        "ttl.txt": u"First"
+    })
+    try:
+        conf=getConfig("http-ttl")
+        conf.load(server.url("ttl.xml"))
+        assert conf.get("sourced") == "First"
+        assert conf.get("sourced") == "First"
+        assert server.responses[-1] == ("/ttl.txt", 200)
+        requests = len(server.responses)
+
+        server.publish("ttl.txt", u"Second")
+        assert conf.get("sourced") == "First"
+        assert len(server.responses) == requests
+        # Content without a ttl is fetched, not taken from the cache
+        url = server.url("ttl.txt")
+        assert conf.get("plain") == "Second"
+        assert len(server.responses) == requests + 1
+        assert url in conf.content_cache
+
+        # Expire it. The file was published within the second, so make
+        # sure it is seen as modified
+        headers, data, checked = conf.content_cache.get(url)
+        headers = dict(headers)
+        del headers['last-modified']
+        conf.content_cache[url] = (headers, data, checked - 60)
+        assert conf.get("sourced") == "Second"
+        assert server.responses[-1] == ("/ttl.txt", 200)
+    finally:
+        server.close()
+
+def testStreamedSource():
+    "open() should decode sourced content as it is read from the server"
+    from base64 import encodebytes
+    from xmlconfig import getConfig
+    data = bytes(bytearray(range(256))) * 1024
+    server = HttpStandIn({
+        "streamed.xml": u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <bytes key="blob" src="blob.b64" encoding="base64"/>
+            </constants>
+        </config>
+        """,
+        "blob.b64": encodebytes(data).decode()
+    })
+    try:
+        conf=getConfig("http-streamed")
+        conf.load(server.url("streamed.xml"))
+        fp = conf.lookup("blob").open()
+        try:
+            chunks = list(fp)
+        finally:
+            fp.close()
+        assert len(chunks) > 1
+        assert b"".join(chunks) == data
+        assert server.responses[-1] == ("/blob.b64", 200)
+        assert conf.get("blob") == data
+    finally:
+        server.close()
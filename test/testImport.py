@@ -4,8 +4,11 @@ import sys
 sys.path.append(sys.path.insert(0,"../src"))
 
 def urlopen(*args, **kwargs):
-    # Only parse one arg: the url
-    return Urls[args[0]]
+    # Only parse one arg: the url. Read from the start each time, like a
+    # new response
+    content = Urls[args[0]]
+    content.seek(0)
+    return content
 
 # Provide a simple hashtable to contain the content of the urls and 
 # provide a mock object similar to what will be returned from the
@@ -152,3 +155,377 @@ def testRelativeImport():
     conf.load("../config/config.xml")
     assert conf.get("imported") == "This was imported from config2.xml"
     
+
+@with_setup(clear_configs)
+def testSnapshotRestore():
+    "Unchanged documents should be restored from their snapshots"
+    from xmlconfig import getConfig
+    import tempfile, shutil
+    documents = {
+        "snapshot.xml": u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants namespace="import" src="file:snapshot2.xml"/>
+            <constants>
+                <section key="section">
+                    <string key="imported">%(import:key22)</string>
+                </section>
+            </constants>
+        </config>
+        """,
+        "snapshot2.xml": u"""<?xml version="1.0"?>
+        <config>
+            <constants>
+                <string key="key22">Restored from a snapshot</string>
+            </constants>
+        </config>
+        """
+    }
+    def publish(modified):
+        for url, content in documents.items():
+            Urls[url] = content
+            Urls[url].headers['last-modified'] = modified
+
+    path = tempfile.mkdtemp()
+    try:
+        Urls.clear()
+        publish(1)
+        conf=getConfig("snapshot")
+        conf.use_snapshots(path)
+        conf.load("snapshot.xml")
+        assert conf.snapshots.misses == 2
+        assert conf.get("section.imported") == "Restored from a snapshot"
+
+        publish(1)
+        conf=getConfig("snapshot-restored")
+        conf.use_snapshots(path)
+        conf.load("snapshot.xml")
+        assert conf.snapshots.hits == 2
+        assert conf.get("section.imported") == "Restored from a snapshot"
+
+        # Modified documents are parsed again
+        publish(2)
+        conf=getConfig("snapshot-modified")
+        conf.use_snapshots(path)
+        conf.load("snapshot.xml")
+        assert conf.snapshots.misses == 2
+    finally:
+        shutil.rmtree(path)
+
+@with_setup(clear_configs)
+def testLazyImport():
+    "Lazy imports should not be loaded until their namespace is used"
+    from xmlconfig import getConfig
+    Urls.clear()
+    Urls["lazy2.xml"] = \
+    """<?xml version="1.0"?>
+    <config>
+        <constants>
+            <string key="key22">This was imported lazily</string>
+        </constants>
+    </config>
+    """
+    Urls["lazy.xml"] = \
+    """<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants namespace="import" src="file:lazy2.xml" options="lazy"/>
+        <constants namespace="import" src="file:lazy3.xml" options="lazy"/>
+        <constants>
+            <string key="local">Local</string>
+            <string key="imported">%(import:key22)</string>
+        </constants>
+    </config>
+    """
+    Urls["lazy3.xml"] = \
+    """<?xml version="1.0"?>
+    <config>
+        <constants>
+            <string key="key33">Also imported lazily</string>
+        </constants>
+    </config>
+    """
+    conf=getConfig("lazy")
+    conf.load("lazy.xml")
+    assert conf.get("local") == "Local"
+    assert "file:lazy2.xml" not in conf._files
+    assert conf.get("imported") == "This was imported lazily"
+    assert "file:lazy2.xml" in conf._files
+    # Every import into the namespace is loaded
+    assert conf.get("import:key33") == "Also imported lazily"
+
+    conf=getConfig("lazy-all")
+    conf.load("lazy.xml")
+    conf.load_deferred()
+    assert "file:lazy2.xml" in conf._files
+    assert "file:lazy3.xml" in conf._files
+    assert conf.get("import:key33") == "Also imported lazily"
+
+@with_setup(clear_configs)
+def testConcurrentImport():
+    "Imports and content should be fetched ahead when loading concurrently"
+    from xmlconfig import getConfig
+    Urls.clear()
+    Urls["file:concurrent.txt"] = "Content fetched ahead"
+    Urls["concurrent3.xml"] = \
+    """<?xml version="1.0"?>
+    <config>
+        <constants>
+            <string key="key33">Imported twice removed</string>
+        </constants>
+    </config>
+    """
+    Urls["concurrent2.xml"] = \
+    """<?xml version="1.0"?>
+    <config>
+        <constants namespace="deeper" src="file:concurrent3.xml"/>
+        <constants>
+            <string key="key22">%(deeper:key33)</string>
+        </constants>
+    </config>
+    """
+    Urls["concurrent.xml"] = \
+    u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants namespace="import" src="file:concurrent2.xml"/>
+        <constants>
+            <string key="imported">%(import:key22)</string>
+            <string key="content" src="file:concurrent.txt"/>
+        </constants>
+    </config>
+    """
+    conf=getConfig("concurrent")
+    conf.load("concurrent.xml", workers=4)
+    assert conf.get("imported") == "Imported twice removed"
+    # Nothing is left over. The content not read yet is kept until it is
+    assert not conf._prefetched
+    assert "file:concurrent.txt" in conf._unread
+    Urls["file:concurrent.txt"] = "Content fetched again"
+    assert conf.get("content") == "Content fetched ahead"
+    assert "file:concurrent.txt" not in conf._unread
+    assert "file:concurrent.txt" not in conf.content_cache
+
+@with_setup(clear_configs)
+def testReloadGeneration():
+    "Reloading should leave what readers already have alone"
+    from xmlconfig import getConfig
+    def publish(value, modified):
+        Urls["generation.xml"] = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="changed">{0}</string>
+                <string key="same">Same</string>
+            </constants>
+        </config>
+        """.format(value)
+        Urls["generation.xml"].headers['last-modified'] = modified
+    Urls.clear()
+    publish("Before", 1)
+    conf=getConfig("generation")
+    conf.load("generation.xml")
+    before, same = conf.lookup("changed"), conf.lookup("same")
+    assert before.value == "Before"
+    updates = []
+    before.on_update += lambda: updates.append("changed")
+    conf.on_update += updates.append
+
+    publish("After", 2)
+    conf.reload()
+    assert conf.get("changed") == "After"
+    assert before.value == "Before"
+    assert conf.lookup("same") is same
+    assert updates == ["changed", "__local:changed"]
+
+@with_setup(clear_configs)
+def testReloadMalformed():
+    "A document that fails to parse on reload should change nothing"
+    from xml.sax import SAXParseException
+    from xmlconfig import getConfig
+    document = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="a">{0} a</string>
+                <string key="b">{0} b</string>
+                <string key="ref">%(a)</string>
+            </constants>
+        </config>
+        """
+    def publish(content, modified):
+        Urls["malformed.xml"] = content
+        Urls["malformed.xml"].headers['last-modified'] = modified
+    Urls.clear()
+    publish(document.format("Before"), 1)
+    conf=getConfig("malformed")
+    conf.load("malformed.xml")
+    assert conf.get("ref") == "Before a"
+    generation = conf._generation
+    after = document.format("After")
+    # Cut off between elements, and inside one
+    for i, cut in enumerate((after.index("<string key=\"b\"") + 5,
+            after.index("After b") + 3)):
+        publish(after[:cut], i + 2)
+        for attempt in range(2):
+            try:
+                conf.reload()
+            except SAXParseException:
+                pass
+            else:
+                raise AssertionError("Malformed document was loaded")
+            assert conf._generation is generation
+            assert conf.get("a") == "Before a"
+            loaded, = conf._files.values()
+            assert loaded['headers']['last-modified'] == 1
+
+    publish(after, 4)
+    conf.reload()
+    assert conf.get("a") == "After a"
+    assert conf.get("ref") == "After a"
+
+@with_setup(clear_configs)
+def testReloadEngine():
+    "Reloading should parse documents with the engine they were loaded with"
+    from xmlconfig import getConfig, XmlConfigDocument
+    def publish(url, value, modified, imports=u""):
+        Urls[url] = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            {0}
+            <constants>
+                <string key="value">{1}</string>
+            </constants>
+        </config>
+        """.format(imports, value)
+        Urls[url].headers['last-modified'] = modified
+    Urls.clear()
+    imports = u'<constants namespace="import" src="engine2.xml"/>'
+    publish("engine.xml", "First", 1, imports)
+    publish("engine2.xml", "First import", 1)
+    parsed = []
+    def recording(name):
+        def engine():
+            parsed.append(name)
+            return engines[name]()
+        return engine
+    engines = XmlConfigDocument.parse_engines
+    XmlConfigDocument.parse_engines = dict((name, recording(name))
+        for name in engines)
+    try:
+        conf=getConfig("reload-engine")
+        conf.load("engine.xml", engine="expat")
+        assert parsed == ["expat", "expat"]
+        publish("engine.xml", "Second", 2, imports)
+        publish("engine2.xml", "Second import", 2)
+        conf.reload()
+        assert conf.get("value") == "Second"
+        assert conf.get("import:value") == "Second import"
+        assert len(parsed) > 2 and set(parsed) == set(["expat"])
+    finally:
+        XmlConfigDocument.parse_engines = engines
+
+@with_setup(clear_configs)
+def testReloadReleasesGeneration():
+    "Constants kept on reload should not keep the previous generation alive"
+    import gc, weakref
+    from xmlconfig import getConfig
+    def publish(value, modified):
+        Urls["released.xml"] = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="changed">{0}</string>
+                <string key="same">Same</string>
+            </constants>
+        </config>
+        """.format(value)
+        Urls["released.xml"].headers['last-modified'] = modified
+    Urls.clear()
+    publish("Before", 1)
+    conf=getConfig("released")
+    conf.load("released.xml")
+    same = conf.lookup("same")
+    documents = []
+    for i in range(3):
+        documents.append(weakref.ref(same.parent.parent))
+        publish(i, i + 2)
+        conf.reload()
+        assert conf.lookup("same") is same
+    gc.collect()
+    assert [x() for x in documents] == [None, None, None]
+    assert same.parent.parent is \
+        conf._generation.documents[same.parent.parent.namespace]
+
+def testReloadDependents():
+    "Constants referring to ones that changed should be worked out again"
+    from xmlconfig import getConfig
+    def publish(url, content, modified):
+        Urls[url] = u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            {0}
+        </config>
+        """.format(content)
+        Urls[url].headers['last-modified'] = modified
+    def publish_main(value, modified):
+        publish("dependents.xml", u"""
+            <constants namespace="other" src="dependents2.xml"/>
+            <constants>
+                <string key="key7">{0}</string>
+                <string key="ref2">This is a forward %(key7)</string>
+                <string key="ref3">%(ref2)!</string>
+                <string key="remote">From %(other:name)</string>
+                <section key="s">
+                    <string key="r">in %(key7)</string>
+                    <string key="far">From %(other:name)</string>
+                </section>
+                <string key="chosen">
+                    <choose>
+                        <default>Not eight</default>
+                        <when test="'%(key7)' == 'Eight'">Eight</when>
+                    </choose>
+                </string>
+            </constants>
+            """.format(value), modified)
+    def publish_other(value, modified):
+        publish("dependents2.xml", u"""
+            <constants>
+                <string key="name">{0}</string>
+            </constants>
+            """.format(value), modified)
+    Urls.clear()
+    publish_main("Seven", 1)
+    publish_other("Other", 1)
+    conf=getConfig("dependents")
+    conf.load("dependents.xml")
+    assert conf.get("ref3") == "This is a forward Seven!"
+    assert conf.get("remote") == "From Other"
+    assert conf.get("chosen") == "Not eight"
+    assert conf.section_dict("s") == {"r": "in Seven", "far": "From Other"}
+    remote = conf.lookup("remote")
+    old_ref2, old_section = conf.lookup("ref2"), conf.lookup("s")
+    old_constants = old_ref2.parent
+    updates = []
+    conf.on_update += updates.append
+
+    publish_main("Eight", 2)
+    conf.reload()
+    assert conf.get("ref2") == "This is a forward Eight"
+    assert conf.get("ref3") == "This is a forward Eight!"
+    assert conf.get("chosen") == "Eight"
+    assert conf.get("s.r") == "in Eight"
+    assert conf.section_dict("s")["r"] == "in Eight"
+    assert conf.get_many(["s"])["s"]["r"] == "in Eight"
+    assert sorted(updates) == ["__local:chosen", "__local:key7",
+        "__local:ref2", "__local:ref3", "__local:s.r"]
+    # Left alone
+    assert conf.lookup("remote") is remote
+    # The previous generation too, for anyone still reading it
+    assert old_constants["ref2"] is old_ref2
+    assert old_ref2.value == "This is a forward Seven"
+    assert old_section.as_dict()["r"] == "in Seven"
+
+    del updates[:]
+    old_section = conf.lookup("s")
+    publish_other("Changed", 2)
+    conf.reload()
+    assert conf.get("remote") == "From Changed"
+    assert conf.section_dict("s") == {"r": "in Eight", "far": "From Changed"}
+    assert conf.get_many(["s"])["s"]["far"] == "From Changed"
+    assert sorted(updates) == ["__local:remote", "__local:s.far",
+        "other:name"]
+    assert old_section.as_dict()["far"] == "From Other"
+    assert conf.lookup("s") is not old_section
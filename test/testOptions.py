@@ -137,3 +137,22 @@ def testFloatBase64Encoded():
         '74881520920962829254091715364367892590360011330530548820466521384146951'
         '941511609')
     
+
+def testLayeredOptions():
+    "Options should only hold what is set, over the shared defaults"
+    from xmlconfig import Options, SimpleConstant
+    first, second = Options(SimpleConstant.default_options), \
+        Options(SimpleConstant.default_options)
+    for options in (first, second):
+        options.merge({"key": "layered", "options": "encoding:base64;no-cache"})
+    assert first.defaults is second.defaults
+    assert dict.__len__(first) == 3
+    assert first["encoding"] == "base64" and first["no-cache"] is True
+    assert first["src"] is None and "src" in first
+    assert first.get("missing", 1) == 1 and "missing" not in first
+    assert dict(first.items()) == dict(SimpleConstant.default_options,
+        key="layered", encoding="base64", **{"no-cache": True})
+    # Setting an option leaves the defaults alone
+    first["src"] = "file.txt"
+    assert second["src"] is None
+    assert SimpleConstant.default_options["src"] is None
@@ -207,3 +207,21 @@ def testSectionReference():
     """), LOCAL_NAMESPACE)
     # XXX This really should be returned as a dict type
     assert type(conf.get("section_import")) is SectionConstant
+
+def testNestedReference():
+    "References can be built from the values of other references"
+    from xmlconfig import getConfig, LOCAL_NAMESPACE
+    from core import stringIOWrapper
+    conf=getConfig()
+    conf.parse(stringIOWrapper(
+    u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="suffix">prod</string>
+            <string key="host-prod">db.example.com</string>
+            <string key="host-dev">localhost</string>
+            <string key="nested-ref">%(host-%(suffix)):%(suffix)</string>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    assert conf.get("nested-ref") == "db.example.com:prod"
@@ -204,6 +204,46 @@ def testTypeChoose():
     assert conf.get("chosen") == "when"
     assert type(conf.get("chosen")) is str
 
+def testChooseMemo():
+    "Choices should be reused until the vars or referenced values change"
+    from xmlconfig import getConfig, LOCAL_NAMESPACE, ChooseHandler
+    from core import stringIOWrapper
+    conf=getConfig()
+    conf.parse(stringIOWrapper(
+    u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="memo-mode">test</string>
+            <string key="memo-chosen" options="no-cache">
+                <choose>
+                    <default>default</default>
+                    <when test="'%(memo-mode)' == 'live'">live</when>
+                    <when test="memo_var == 1">var</when>
+                </choose>
+            </string>
+        </constants>
+    </config>
+    """), LOCAL_NAMESPACE)
+    ChooseHandler.vars["memo_var"] = 0
+    try:
+        assert conf.get("memo-chosen") == "default"
+        compiled = len(ChooseHandler._compiled)
+        assert conf.get("memo-chosen") == "default"
+        assert len(ChooseHandler._compiled) == compiled
+        ChooseHandler.vars["memo_var"] = 1
+        assert conf.get("memo-chosen") == "var"
+        conf.parse(stringIOWrapper(
+        u"""<?xml version="1.0" encoding="utf-8"?>
+        <config>
+            <constants>
+                <string key="memo-mode">live</string>
+            </constants>
+        </config>
+        """), LOCAL_NAMESPACE)
+        assert conf.get("memo-chosen") == "live"
+    finally:
+        del ChooseHandler.vars["memo_var"]
+
 from nose.tools import raises
 
 @raises(NameError)
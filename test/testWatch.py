@@ -0,0 +1,84 @@
+# encoding: utf-8
+
+import sys
+sys.path.append(sys.path.insert(0,"../src"))
+
+import os, shutil, tempfile, time
+if sys.version_info >= (3,0):
+    from urllib.request import urlopen
+else:
+    from urllib2 import urlopen
+
+def document(value):
+    return u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants namespace="import" src="watched2.xml"/>
+        <constants>
+            <string key="watched">{0}</string>
+            <string key="unchanged">Unchanged</string>
+            <string key="imported">%(import:key22)</string>
+        </constants>
+    </config>
+    """.format(value)
+
+def document2(value):
+    return u"""<?xml version="1.0" encoding="utf-8"?>
+    <config>
+        <constants>
+            <string key="key22">{0}</string>
+        </constants>
+    </config>
+    """.format(value)
+
+def checkWatcher(name, create_watcher):
+    import xmlconfig
+    from xmlconfig import getConfig
+    path = tempfile.mkdtemp()
+    # The testImport module replaces urlopen with a mock
+    mocked, xmlconfig.urlopen = xmlconfig.urlopen, urlopen
+    def write(name, content):
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(content)
+    def wait_for(what):
+        for x in range(200):
+            if what():
+                return True
+            time.sleep(0.025)
+    try:
+        write("watched.xml", document("Before"))
+        write("watched2.xml", document2("Imported"))
+        conf=getConfig(name)
+        conf.load(os.path.join(path, "watched.xml"))
+        assert conf.get("watched") == "Before"
+        assert conf.get("unchanged") == "Unchanged"
+
+        updates = []
+        conf.on_update += updates.append
+        conf._watcher = create_watcher(conf, 0.05)
+        conf._watcher.start()
+        # Let the watcher get its bearings
+        time.sleep(0.2)
+
+        write("watched.xml", document("After"))
+        assert wait_for(lambda: conf.get("watched") == "After")
+        assert updates == ["__local:watched"]
+        assert conf.get("unchanged") == "Unchanged"
+
+        # Only the imported document is reloaded
+        write("watched2.xml", document2("Imported again"))
+        assert wait_for(lambda: "import:key22" in updates)
+        assert conf.get("import:key22") == "Imported again"
+    finally:
+        conf.unwatch()
+        xmlconfig.urlopen = mocked
+        shutil.rmtree(path)
+
+def testPollingWatcher():
+    "Polling for changed files should reload them"
+    from xmlconfig.watch import PollingWatcher
+    checkWatcher("polling-watcher", PollingWatcher)
+
+def testWatcher():
+    "The preferred watcher (inotify on Linux) should reload changed files"
+    from xmlconfig.watch import create_watcher
+    checkWatcher("watcher", create_watcher)